@@ -0,0 +1,9 @@
+from django.test.runner import DiscoverRunner
+
+# Benchmarks and other tests tagged 'slow' take minutes or depend on the machine's
+# speed, so they only run when asked for, e.g. python manage.py test --tag slow
+class TestRunner(DiscoverRunner):
+    def __init__(self, tags=None, exclude_tags=None, **kwargs):
+        if not tags:
+            exclude_tags = {*(exclude_tags or ()), 'slow'}
+        super().__init__(tags=tags, exclude_tags=exclude_tags, **kwargs)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -55,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'recipes.middleware.CacheGenerationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -136,9 +138,78 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+#TESTS
+# Leaves out tests tagged 'slow' unless they are asked for with --tag slow
+TEST_RUNNER = 'recipe_project.runner.TestRunner'
+
 #AUTH
 LOGIN_URL='/login'
 
+#CHARTS
+# Maximum number of rendered charts kept in each worker's memory
+CHART_CACHE_SIZE = 128
+# Processes used to render charts outside the request; 0 renders them in the request
+CHART_RENDER_WORKERS = int(os.environ.get('CHART_RENDER_WORKERS', 2))
+# Seconds a finished chart job is kept for polling before it is cleaned up
+CHART_JOB_TTL = 60 * 60
+# Seconds a chart job may stay pending before it is reported as failed
+CHART_RENDER_TIMEOUT = 60
+# Default chart output: 'png' is rasterised by matplotlib, 'svg' is a lightweight vector drawing
+CHART_FORMAT = os.environ.get('CHART_FORMAT', 'png')
+# Larger results are reduced to this many bars (the rest become an 'Other' bar) or line points
+CHART_MAX_BARS = 20
+CHART_MAX_POINTS = 50
+
+#PAGINATION
+# Recipes per page on the home, list and profile pages; later pages load as the user scrolls
+RECIPES_PAGE_SIZE = 24
+
+#CACHES
+# Rendered cards, anonymous pages and search results are kept on disk so every worker process on the machine shares them.
+# The backend only checks whether to cull every CULL_EVERY writes, so writing a page of cards stays cheap as the cache fills
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'recipe_app_cache'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    },
+    'cards': {
+        'BACKEND': 'recipes.cache_backends.PeriodicCullFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'cards'),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_EVERY': 100
+        }
+    },
+    'pages': {
+        'BACKEND': 'recipes.cache_backends.PeriodicCullFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'pages'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'CULL_EVERY': 20
+        }
+    },
+    'search': {
+        'BACKEND': 'recipes.cache_backends.PeriodicCullFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'search'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'CULL_EVERY': 20
+        }
+    }
+}
+
+# Seconds a search's results are reused for; any recipe change also invalidates them
+SEARCH_CACHE_TIMEOUT = 5 * 60
+
+#LEADERBOARD
+# Days of favorites counted towards a recipe's trending score
+TRENDING_DAYS = 7
+# Recipes shown on each leaderboard
+LEADERBOARD_SIZE = 10
+
 # Heroku: Update database configuration from $DATABASE_URL.
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
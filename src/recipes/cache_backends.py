@@ -0,0 +1,17 @@
+from django.core.cache.backends.filebased import FileBasedCache
+
+# FileBasedCache lists its whole directory on every write to see whether it needs
+# culling, so writes slow down as the cache fills. This checks once every
+# CULL_EVERY writes in each process, so the cache can run that many entries per
+# worker over MAX_ENTRIES before it is culled
+class PeriodicCullFileBasedCache(FileBasedCache):
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_every = int(params.get('OPTIONS', {}).get('CULL_EVERY', 100))
+        self._writes = 0
+
+    def _cull(self):
+        self._writes += 1
+        if self._writes >= self._cull_every:
+            self._writes = 0
+            super()._cull()
@@ -0,0 +1,28 @@
+from django.core.cache import caches
+from django.template.loader import get_template
+
+# Covers everything a card shows: the version changes on every save, favorite_count
+# changes through F() updates that don't save, and the user only decides whether
+# the card links through and whether the heart is filled in. Cards under old keys
+# are never read again and leave the cache when they time out
+def get_card_key(template_name, recipe, is_authenticated, is_favorited):
+    return f'card:{template_name}:{recipe.pk}:{recipe.version}:{recipe.favorite_count}:{int(is_authenticated)}{int(is_favorited)}'
+
+# One get_many for the whole page, then only the cards that weren't cached are rendered
+def render_cards(recipes, template_name, user):
+    recipes = list(recipes)
+    cache = caches['cards']
+    is_authenticated = bool(user and user.is_authenticated)
+
+    keys = [get_card_key(template_name, recipe, is_authenticated, getattr(recipe, 'is_favorited', False)) for recipe in recipes]
+    cards = cache.get_many(keys)
+
+    rendered = {}
+    for key, recipe in zip(keys, recipes):
+        if key not in cards:
+            rendered[key] = cards[key] = get_template(template_name).render({'recipe': recipe, 'user': user})
+
+    if rendered:
+        cache.set_many(rendered)
+
+    return ''.join(cards[key] for key in keys)
@@ -1,5 +1,7 @@
 from django import forms
-from .models import Recipe
+from .models import Recipe, Ingredient
+from .indexes import parse_ingredient_query
+from .utils import get_chart_format
 
 CHART_CHOICES = (
     ('#1', 'None'),
@@ -8,6 +10,11 @@ CHART_CHOICES = (
     ('#4', 'Line chart')
 )
 
+CHART_FORMAT_CHOICES = (
+    ('png', 'Image (PNG)'),
+    ('svg', 'Vector (SVG)')
+)
+
 DIFFICULTY_CHOICES = (
     ('', 'Any'),
     ('Easy', 'Easy'),
@@ -16,12 +23,64 @@ DIFFICULTY_CHOICES = (
     ('Hard', 'Hard')
 )
 
+SORT_CHOICES = (
+    ('newest', 'Newest'),
+    ('cooking_time', 'Cooking Time'),
+    ('difficulty', 'Difficulty'),
+    ('favorites', 'Most Favorited')
+)
+
 class RecipesSearchForm(forms.Form):
     recipe_name = forms.CharField(max_length=120, required=False, label='Recipe Name')
     ingredient = forms.CharField(max_length=120, required=False, label='Ingredient')
+    ingredient_query = forms.CharField(
+        max_length=500,
+        required=False,
+        label='Ingredients',
+        widget=forms.TextInput(attrs={'placeholder': 'chicken AND garlic NOT dairy'})
+    )
+    keywords = forms.CharField(max_length=120, required=False, label='Keywords')
     difficulty= forms.ChoiceField(choices=DIFFICULTY_CHOICES, required=False)
     max_cooking_time = forms.IntegerField(required=False, min_value=1, label='Max Cooking Time (minutes)')
     chart_type = forms.ChoiceField(choices=CHART_CHOICES)
+    chart_format = forms.ChoiceField(choices=CHART_FORMAT_CHOICES, required=False, initial=get_chart_format, label='Chart Format')
+
+    def clean_ingredient_query(self):
+        ingredient_query = self.cleaned_data['ingredient_query']
+        try:
+            parse_ingredient_query(ingredient_query)
+        except ValueError as error:
+            raise forms.ValidationError(str(error))
+        return ingredient_query
+
+    # The cleaned data in a canonical form, so searches that can only match the same
+    # recipes share one cache entry: text is trimmed and case-folded, and an
+    # ingredient query becomes its sorted groups of normalised names
+    def get_normalized_data(self):
+        data = self.cleaned_data
+        groups = parse_ingredient_query(data['ingredient_query'])
+
+        return {
+            'recipe_name': ' '.join(data['recipe_name'].split()).casefold(),
+            'ingredient': Ingredient.normalize(data['ingredient']),
+            'ingredient_query': sorted([sorted(set(included)), sorted(set(excluded))] for included, excluded in groups),
+            'keywords': ' '.join(data['keywords'].split()).casefold(),
+            'difficulty': data['difficulty'],
+            'max_cooking_time': data['max_cooking_time'],
+            'chart_type': data['chart_type']
+        }
+
+class RecipeListForm(forms.Form):
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False, label='Sort By')
+    difficulty = forms.ChoiceField(choices=DIFFICULTY_CHOICES, required=False)
+    max_cooking_time = forms.IntegerField(required=False, min_value=1, label='Max Cooking Time (minutes)')
+
+class PantryForm(forms.Form):
+    ingredients = forms.CharField(
+        max_length=2000,
+        label='Ingredients you have',
+        widget=forms.Textarea(attrs={'rows': 3, 'placeholder': 'eggs, flour, milk, butter'})
+    )
 
 class AddRecipeForm(forms.ModelForm):
     class Meta:
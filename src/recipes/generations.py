@@ -0,0 +1,59 @@
+from collections import defaultdict
+import secrets
+import threading
+from django.db import transaction
+from django.utils import timezone
+from .models import CacheGeneration
+
+_lock = threading.Lock()
+_seen = {}
+_invalidators = defaultdict(list)
+
+# Calls callback whenever another process changes the named generation
+def register_invalidator(name, callback):
+    _invalidators[name].append(callback)
+
+# Moves the generation in the same transaction as the change it announces, so other
+# workers see both at once. A fresh random value rather than a counter means a rolled
+# back bump can't be repeated later with different data behind it
+def bump_generation(name):
+    value = secrets.randbits(62)
+    with transaction.atomic():
+        # Writing first takes the row lock on Postgres and the write lock on SQLite,
+        # so the value read next can't change before it is replaced
+        if not CacheGeneration.objects.filter(name=name).update(updated=timezone.now()):
+            CacheGeneration.objects.get_or_create(name=name)
+        previous = CacheGeneration.objects.filter(name=name).values_list('value', flat=True).get()
+        CacheGeneration.objects.filter(name=name).update(value=value)
+
+    # This process's caches already reflect its own change, but only if it hadn't
+    # missed one from another worker first
+    with _lock:
+        if _seen.get(name) == previous:
+            _seen[name] = value
+
+# Reads every generation in one query and runs the invalidators of those that have
+# moved since this process last looked. Returns {name: (value, updated)}
+def check_generations():
+    generations = {
+        name: (value, updated)
+        for name, value, updated in CacheGeneration.objects.values_list('name', 'value', 'updated')
+    }
+
+    stale = []
+    with _lock:
+        for name, (value, updated) in generations.items():
+            if _seen.get(name) != value:
+                _seen[name] = value
+                stale.append(name)
+
+    for name in stale:
+        for callback in _invalidators[name]:
+            callback()
+
+    return generations
+
+def get_generations(request):
+    if not hasattr(request, 'cache_generations'):
+        request.cache_generations = check_generations()
+    return request.cache_generations
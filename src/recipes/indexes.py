@@ -0,0 +1,239 @@
+from array import array
+from bisect import bisect_left, insort
+import re
+import threading
+from .models import Recipe, Ingredient
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# Splits 'chicken AND garlic NOT dairy OR tofu' into OR-ed groups of
+# (included, excluded) ingredient names; commas work as AND
+def parse_ingredient_query(text):
+    groups = []
+    included, excluded = [], []
+    words, negate, operator = [], False, None
+
+    def finish_term():
+        name = Ingredient.normalize(' '.join(words))
+        if not name:
+            raise ValueError(f'Expected an ingredient after {operator or "the start"}')
+        (excluded if negate else included).append(name)
+        words.clear()
+
+    for token in re.findall(r',|[^\s,]+', text):
+        if token not in OPERATORS and token != ',':
+            words.append(token)
+            continue
+
+        if words:
+            finish_term()
+        elif token != 'NOT' or operator == 'NOT':
+            raise ValueError(f'Expected an ingredient before {token}')
+
+        if token == 'OR':
+            groups.append((included, excluded))
+            included, excluded = [], []
+        negate = token == 'NOT'
+        operator = token
+
+    if words:
+        finish_term()
+    elif operator:
+        raise ValueError(f'Expected an ingredient after {operator}')
+
+    if included or excluded:
+        groups.append((included, excluded))
+    return groups
+
+# The names a pantry item owns: itself and its simple plural or singular, so 'tomato'
+# owns 'tomatoes' and 'berries' owns 'berry', but 'egg' doesn't own 'eggplant'
+def get_ingredient_forms(name):
+    forms = {name, f'{name}s', f'{name}es'}
+    if name.endswith('ies'):
+        forms.add(f'{name[:-3]}y')
+    elif name.endswith('y'):
+        forms.add(f'{name[:-1]}ies')
+    if name.endswith('es'):
+        forms.add(name[:-2])
+    if name.endswith('s') and not name.endswith('ss'):
+        forms.add(name[:-1])
+    return forms
+
+def iter_bits(bits):
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for offset, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield offset * 8 + low.bit_length() - 1
+            byte ^= low
+
+# Each recipe gets a dense slot number and each ingredient name a bitmap of the
+# slots whose recipes use it, held as a Python int, so a query is a handful of
+# word-wise ANDs and ORs. The index is per process: it is built from the database
+# on first use and then kept current by the Recipe save and delete signals
+class IngredientIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._built = False
+        self._slots = {}
+        self._pks = []
+        self._free = []
+        self._recipe_names = {}
+        self._sizes = array('I')
+        self._postings = {}
+        self._names = []
+        self._all = 0
+
+    def build(self):
+        with self._lock:
+            self.clear()
+            for pk, ingredients in Recipe.objects.values_list('pk', 'ingredients').iterator():
+                self._add(pk, ingredients)
+            self._built = True
+
+    # Drops everything, to be rebuilt on next use
+    def invalidate(self):
+        with self._lock:
+            self.clear()
+
+    def _ensure_built(self):
+        if not self._built:
+            self.build()
+
+    def _add(self, pk, ingredients):
+        slot = self._free.pop() if self._free else len(self._pks)
+        names = {Ingredient.normalize(name) for name in Recipe.split_ingredients(ingredients)}
+        names.discard('')
+
+        if slot == len(self._pks):
+            self._pks.append(pk)
+            self._sizes.append(len(names))
+        else:
+            self._pks[slot] = pk
+            self._sizes[slot] = len(names)
+        self._slots[pk] = slot
+        self._recipe_names[slot] = names
+
+        bit = 1 << slot
+        self._all |= bit
+        for name in names:
+            if name not in self._postings:
+                self._postings[name] = 0
+                insort(self._names, name)
+            self._postings[name] |= bit
+
+    def _remove(self, pk):
+        slot = self._slots.pop(pk, None)
+        if slot is None:
+            return
+
+        bit = 1 << slot
+        self._all &= ~bit
+        for name in self._recipe_names.pop(slot):
+            self._postings[name] &= ~bit
+            if not self._postings[name]:
+                del self._postings[name]
+                del self._names[bisect_left(self._names, name)]
+
+        self._pks[slot] = None
+        self._sizes[slot] = 0
+        self._free.append(slot)
+
+    def update(self, recipe):
+        with self._lock:
+            if self._built:
+                self._remove(recipe.pk)
+                self._add(recipe.pk, recipe.ingredients)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._built:
+                self._remove(pk)
+
+    def _expand(self, term):
+        index = bisect_left(self._names, term)
+        while index < len(self._names) and self._names[index].startswith(term):
+            yield self._names[index]
+            index += 1
+
+    # Union of the bitmaps of every ingredient whose name starts with the term
+    def _match(self, term):
+        bits = 0
+        for name in self._expand(term):
+            bits |= self._postings[name]
+        return bits
+
+    def _evaluate(self, groups):
+        result = 0
+        for included, excluded in groups:
+            bits = self._all
+            for term in included:
+                bits &= self._match(term)
+            for term in excluded:
+                bits &= ~self._match(term)
+            result |= bits
+        return result
+
+    def search(self, query):
+        groups = parse_ingredient_query(query) if isinstance(query, str) else query
+        self._ensure_built()
+
+        with self._lock:
+            return [self._pks[slot] for slot in iter_bits(self._evaluate(groups))]
+
+    def count(self, query):
+        groups = parse_ingredient_query(query) if isinstance(query, str) else query
+        self._ensure_built()
+
+        with self._lock:
+            return self._evaluate(groups).bit_count()
+
+    # Ranks recipes by the fraction of their ingredients found in the pantry, then
+    # by fewest missing. Pantry items own ingredients by exact name, allowing for
+    # plurals, rather than by the prefix search uses. Each owned ingredient's bitmap
+    # is unpacked into a numpy array and summed, giving every recipe's owned count
+    # in one pass per ingredient
+    def cover(self, pantry, limit=20):
+        # Imported on first use, so workers that never rank a pantry don't load numpy
+        import numpy as np
+
+        terms = {Ingredient.normalize(name) for name in pantry}
+        terms.discard('')
+        self._ensure_built()
+
+        with self._lock:
+            size = len(self._pks)
+            owned = {name for term in terms for name in get_ingredient_forms(term) if name in self._postings}
+            if not size or not owned:
+                return []
+
+            length = (size + 7) // 8
+            counts = np.zeros(size, dtype=np.uint32)
+            for name in owned:
+                packed = np.frombuffer(self._postings[name].to_bytes(length, 'little'), dtype=np.uint8)
+                counts += np.unpackbits(packed, count=size, bitorder='little')
+
+            slots = np.flatnonzero(counts)
+            sizes = np.frombuffer(self._sizes, dtype=np.uint32)[slots]
+            missing = sizes - counts[slots]
+            coverage = counts[slots] / sizes
+
+            # Only the best limit recipes need sorting, plus any tied with the last of them
+            if len(slots) > limit:
+                cutoff = np.partition(coverage, len(slots) - limit)[len(slots) - limit]
+                keep = coverage >= cutoff
+                slots, missing, coverage = slots[keep], missing[keep], coverage[keep]
+
+            order = np.lexsort((slots, missing, -coverage))[:limit]
+            return [
+                (self._pks[slots[i]], float(coverage[i]), sorted(self._recipe_names[slots[i]] - owned))
+                for i in order
+            ]
+
+    def __len__(self):
+        return len(self._slots)
+
+ingredient_index = IngredientIndex()
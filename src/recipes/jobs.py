@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from functools import partial
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from .models import ChartJob
+from .utils import CONTENT_TYPES, chart_cache, get_chart_key, plot_chart, render_chart
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.CHART_RENDER_WORKERS)
+        return _executor
+
+# A render process that dies, e.g. killed for using too much memory, breaks the whole
+# pool, so it is dropped and the next render starts a new one
+def reset_executor(broken):
+    global _executor
+
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+
+# Jobs are keyed by the chart's content, so every search that plots the same values
+# shares one row and one chart URL that browsers and CDNs can keep indefinitely
+def submit_chart_job(chart_type, series, chart_format='png'):
+    if series is None:
+        return None
+
+    ChartJob.objects.filter(created__lt=timezone.now() - timedelta(seconds=settings.CHART_JOB_TTL)).delete()
+
+    # Failed jobs, and pending ones whose render never reported back, are submitted again
+    key = get_chart_key(series, chart_format)
+    stale = timezone.now() - timedelta(seconds=settings.CHART_RENDER_TIMEOUT)
+    job = (
+        ChartJob.objects.defer('image')
+        .exclude(status=ChartJob.FAILED)
+        .exclude(status=ChartJob.PENDING, created__lt=stale)
+        .filter(pk=key)
+        .first()
+    )
+    if job is not None:
+        return job
+
+    image = chart_cache.get(key)
+
+    # SVG is cheap enough to build in the request, as are PNGs when there is no render pool
+    if image is None and (chart_format != 'png' or not settings.CHART_RENDER_WORKERS):
+        image = render_chart(series, chart_format)
+        chart_cache.set(key, image)
+
+    fields = {'chart_type': chart_type, 'series': series, 'content_type': CONTENT_TYPES[chart_format], 'created': timezone.now()}
+    if image is not None:
+        job, created = ChartJob.objects.update_or_create(pk=key, defaults=dict(fields, status=ChartJob.DONE, image=image))
+        return job
+
+    job, created = ChartJob.objects.update_or_create(pk=key, defaults=dict(fields, status=ChartJob.PENDING, image=b''))
+    executor = get_executor()
+    try:
+        future = executor.submit(plot_chart, series)
+    except BrokenProcessPool:
+        # This chart is rendered in the request; the next one gets a new pool
+        reset_executor(executor)
+        image = plot_chart(series)
+        chart_cache.set(key, image)
+        job, created = ChartJob.objects.update_or_create(pk=key, defaults=dict(fields, status=ChartJob.DONE, image=image))
+        return job
+
+    future.add_done_callback(partial(finish_chart_job, key, threading.get_ident()))
+    return job
+
+# Tries a job's update a few times, backing off between attempts, since the result
+# thread can find the table briefly locked by a request writing at the same moment
+CHART_JOB_UPDATE_ATTEMPTS = 3
+
+def update_chart_job(key, **fields):
+    for attempt in range(CHART_JOB_UPDATE_ATTEMPTS):
+        try:
+            return ChartJob.objects.filter(pk=key).update(**fields)
+        except DatabaseError:
+            if attempt == CHART_JOB_UPDATE_ATTEMPTS - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+# Usually runs on the executor's result thread, which needs its own connection
+# closed afterwards; if the render already finished it runs in the request thread.
+# Any failure, including saving the chart, leaves the job FAILED rather than PENDING
+def finish_chart_job(key, submitter, future):
+    try:
+        image = future.result()
+        chart_cache.set(key, image)
+        update_chart_job(key, status=ChartJob.DONE, image=image)
+    except Exception:
+        try:
+            update_chart_job(key, status=ChartJob.FAILED)
+        except DatabaseError:
+            # The chart view reports the job as failed once it has been pending too long
+            pass
+    finally:
+        if threading.get_ident() != submitter:
+            connections.close_all()
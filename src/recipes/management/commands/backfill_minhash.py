@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe, RecipeBucket
+from recipes.similarity import get_buckets, get_signatures
+
+class Command(BaseCommand):
+    help = 'Computes MinHash signatures and LSH buckets for every recipe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes, or 0 to run in this process')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def get_batches(self, batch_size):
+        rows = Recipe.objects.order_by('pk').values_list('pk', 'ingredients').iterator(chunk_size=batch_size)
+        while True:
+            batch = [(pk, Recipe(ingredients=ingredients).get_ingredient_names()) for pk, ingredients in islice(rows, batch_size)]
+            if not batch:
+                return
+            yield batch
+
+    def save_batch(self, signatures):
+        with transaction.atomic():
+            Recipe.objects.bulk_update([Recipe(pk=pk, minhash=signature) for pk, signature in signatures], ['minhash'])
+            RecipeBucket.objects.filter(recipe_id__in=[pk for pk, signature in signatures]).delete()
+            RecipeBucket.objects.bulk_create([
+                RecipeBucket(recipe_id=pk, band=band, bucket=bucket)
+                for pk, signature in signatures if signature is not None
+                for band, bucket in get_buckets(signature)
+            ])
+
+    def handle(self, *args, **options):
+        batches = self.get_batches(options['batch_size'])
+        total = 0
+
+        if options['workers'] == 0:
+            for signatures in map(get_signatures, batches):
+                self.save_batch(signatures)
+                total += len(signatures)
+        else:
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                for signatures in executor.map(get_signatures, batches):
+                    self.save_batch(signatures)
+                    total += len(signatures)
+
+        self.stdout.write(self.style.SUCCESS(f'Computed signatures for {total} recipes'))
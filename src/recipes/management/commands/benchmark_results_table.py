@@ -0,0 +1,57 @@
+import time
+import tracemalloc
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from recipes.tables import render_results_table
+
+DIFFICULTIES = ('Easy', 'Medium', 'Intermediate', 'Hard')
+
+# The table as search used to build it, through a DataFrame and to_html
+def render_pandas_table(rows):
+    pks, names, cooking_times, difficulties = zip(*rows)
+    recipes_df = pd.DataFrame({
+        'Name': [f'<a href="{reverse("recipes:detail", kwargs={"pk": pk})}">{name}</a>' for pk, name in zip(pks, names)],
+        'Cooking Time': [f'{cooking_time} min' for cooking_time in cooking_times],
+        'Difficulty': difficulties
+    })
+    return recipes_df.to_html(escape=False, index=False, classes='results-table')
+
+def get_rows(count):
+    return [(pk, f'Recipe {pk} & Sides', pk % 120 + 1, DIFFICULTIES[pk % 4]) for pk in range(1, count + 1)]
+
+# Best wall time over repeat runs, and the peak memory allocated by one more
+def measure(render, rows, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(rows)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        render(rows)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return min(timings), peak
+
+class Command(BaseCommand):
+    help = 'Compares rendering the search results table with and without pandas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"Rows":>8}  {"pandas ms":>10}  {"stream ms":>10}  {"pandas MB":>10}  {"stream MB":>10}')
+
+        for size in options['sizes']:
+            rows = get_rows(size)
+            pandas_time, pandas_peak = measure(render_pandas_table, rows, options['repeat'])
+            stream_time, stream_peak = measure(render_results_table, rows, options['repeat'])
+            self.stdout.write(
+                f'{size:>8}  {pandas_time * 1000:>10.1f}  {stream_time * 1000:>10.1f}  '
+                f'{pandas_peak / 2 ** 20:>10.1f}  {stream_peak / 2 ** 20:>10.1f}'
+            )
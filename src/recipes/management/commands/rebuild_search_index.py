@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+from recipes.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index from the recipe table'
+
+    def handle(self, *args, **options):
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Recipe.objects.count()} recipes'))
@@ -0,0 +1,11 @@
+from .generations import get_generations
+
+# Checks the cache generations once at the start of every request, so a worker
+# never serves from caches another worker has since invalidated
+class CacheGenerationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        get_generations(request)
+        return self.get_response(request)
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_chartjob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chartjob',
+            name='chart',
+        ),
+        migrations.AddField(
+            model_name='chartjob',
+            name='content_type',
+            field=models.CharField(default='image/png', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='chartjob',
+            name='etag',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='chartjob',
+            name='image',
+            field=models.BinaryField(blank=True),
+        ),
+    ]
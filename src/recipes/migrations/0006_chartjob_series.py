@@ -0,0 +1,18 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_chartjob_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chartjob',
+            name='series',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
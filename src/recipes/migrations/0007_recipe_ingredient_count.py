@@ -0,0 +1,30 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+def backfill_ingredient_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    recipes = []
+
+    for recipe in Recipe.objects.only('pk', 'ingredients').iterator():
+        recipe.ingredient_count = len(recipe.ingredients.split(','))
+        recipes.append(recipe)
+
+    Recipe.objects.bulk_update(recipes, ['ingredient_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_chartjob_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ingredient_count, migrations.RunPython.noop),
+    ]
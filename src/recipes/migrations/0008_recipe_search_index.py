@@ -0,0 +1,71 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:40
+
+from django.db import migrations
+
+
+SQLITE_FORWARDS = [
+    """
+    CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, ingredients, instructions,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    # Matches in the name count for more than matches in the instructions
+    "INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')",
+    """
+    INSERT INTO recipes_recipe_fts (rowid, name, ingredients, instructions)
+    SELECT id, name, ingredients, instructions FROM recipes_recipe
+    """,
+]
+
+SQLITE_BACKWARDS = [
+    'DROP TABLE recipes_recipe_fts',
+]
+
+POSTGRES_FORWARDS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(ingredients, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(instructions, '')), 'C')
+    ) STORED
+    """,
+    'CREATE INDEX recipes_recipe_search_vector ON recipes_recipe USING GIN (search_vector)',
+    'CREATE INDEX recipes_recipe_name_trgm ON recipes_recipe USING GIN (name gin_trgm_ops)',
+    'CREATE INDEX recipes_recipe_ingredients_trgm ON recipes_recipe USING GIN (ingredients gin_trgm_ops)',
+]
+
+POSTGRES_BACKWARDS = [
+    'DROP INDEX recipes_recipe_ingredients_trgm',
+    'DROP INDEX recipes_recipe_name_trgm',
+    'ALTER TABLE recipes_recipe DROP COLUMN search_vector',
+]
+
+
+def run_for_vendor(sqlite, postgres):
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite,
+            'postgresql': postgres,
+        }.get(schema_editor.connection.vendor, [])
+
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_ingredient_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARDS, POSTGRES_FORWARDS),
+            run_for_vendor(SQLITE_BACKWARDS, POSTGRES_BACKWARDS),
+        ),
+    ]
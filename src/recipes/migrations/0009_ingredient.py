@@ -0,0 +1,63 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ingredients(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+
+    recipe_names = {}
+    for pk, ingredients in Recipe.objects.values_list('pk', 'ingredients').iterator():
+        names = (' '.join(name.lower().split())[:120] for name in ingredients.split(','))
+        recipe_names[pk] = list(dict.fromkeys(name for name in names if name))
+
+    all_names = {name for names in recipe_names.values() for name in names}
+    Ingredient.objects.bulk_create([Ingredient(name=name) for name in all_names], ignore_conflicts=True)
+    ingredient_ids = dict(Ingredient.objects.values_list('name', 'pk'))
+
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe_id=pk, ingredient_id=ingredient_ids[name], position=position)
+        for pk, names in recipe_names.items()
+        for position, name in enumerate(names)
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=120, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.ingredient')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.recipe')),
+            ],
+            options={
+                'ordering': ['recipe', 'position'],
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_items',
+            field=models.ManyToManyField(blank=True, related_name='recipes', through='recipes.RecipeIngredient', to='recipes.ingredient'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeingredient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.RunPython(backfill_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:49
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_sort_fields(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = Recipe.favorited_by.through
+
+    ranks = {'Easy': 1, 'Medium': 2, 'Intermediate': 3, 'Hard': 4}
+    favorites = (
+        Favorite.objects.filter(recipe_id=OuterRef('pk'))
+        .order_by()
+        .values('recipe_id')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+
+    Recipe.objects.update(
+        difficulty_rank=Case(
+            *[When(difficulty=difficulty, then=Value(rank)) for difficulty, rank in ranks.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        favorite_count=Coalesce(Subquery(favorites), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_minhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='difficulty_rank',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_sort_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['cooking_time', 'id'], name='recipe_cooking_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['difficulty_rank', 'cooking_time', 'id'], name='recipe_difficulty_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['difficulty_rank', 'id'], name='recipe_difficulty_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['favorite_count', 'id'], name='recipe_favorites_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['difficulty_rank', 'favorite_count', 'id'], name='recipe_difficulty_favs_idx'),
+        ),
+    ]
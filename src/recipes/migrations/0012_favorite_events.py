@@ -0,0 +1,40 @@
+# Generated by Django 4.2.26 on 2026-10-18 02:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_recipe_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeTrend',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='recipes.recipe')),
+                ('recent_favorites', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recent_favorites', 'recipe'], name='recipe_trend_rank_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FavoriteEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.SmallIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expired', models.BooleanField(default=False)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favorite_events', to='recipes.recipe')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='favorite_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expired', 'created'], name='favorite_event_expiry_idx'), models.Index(fields=['recipe', 'created'], name='favorite_event_recipe_idx')],
+            },
+        ),
+    ]
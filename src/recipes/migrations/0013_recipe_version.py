@@ -0,0 +1,19 @@
+# Generated by Django 4.2.26 on 2026-10-18 03:12
+
+from django.db import migrations, models
+import recipes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_favorite_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='version',
+            field=models.PositiveIntegerField(default=recipes.models.get_card_version, editable=False),
+        ),
+    ]
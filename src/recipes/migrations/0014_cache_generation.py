@@ -0,0 +1,28 @@
+# Generated by Django 4.2.26 on 2026-10-18 03:22
+
+from django.db import migrations, models
+
+
+def create_generations(apps, schema_editor):
+    CacheGeneration = apps.get_model('recipes', 'CacheGeneration')
+    for name in ('recipes', 'favorites'):
+        CacheGeneration.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheGeneration',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(create_generations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.26 on 2026-10-18 04:00
+
+from django.db import migrations, models
+
+
+# Jobs from before charts were keyed by content are short lived, so they are dropped
+# rather than rekeyed; the next search for each chart renders it again
+def delete_jobs(apps, schema_editor):
+    apps.get_model('recipes', 'ChartJob').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_cache_generation'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='chartjob',
+            name='etag',
+        ),
+        migrations.AlterField(
+            model_name='chartjob',
+            name='id',
+            field=models.CharField(max_length=64, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+from recipes.similarity import get_buckets
+
+
+# Buckets depend on how the signature is split into bands, so they are rebuilt
+# from the stored signatures whenever the bands change
+def rebuild_buckets(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeBucket = apps.get_model('recipes', 'RecipeBucket')
+
+    RecipeBucket.objects.all().delete()
+    recipes = Recipe.objects.exclude(minhash=None).values_list('pk', 'minhash').iterator(chunk_size=1000)
+    batch = []
+    for pk, signature in recipes:
+        batch.extend(RecipeBucket(recipe_id=pk, band=band, bucket=bucket) for band, bucket in get_buckets(signature))
+        if len(batch) >= 10000:
+            RecipeBucket.objects.bulk_create(batch)
+            batch = []
+    RecipeBucket.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_chartjob_content_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_buckets, migrations.RunPython.noop),
+    ]
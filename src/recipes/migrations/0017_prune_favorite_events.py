@@ -0,0 +1,25 @@
+# Generated by Django 4.2.26 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_rebuild_recipe_buckets'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='favoriteevent',
+            name='favorite_event_expiry_idx',
+        ),
+        migrations.RemoveField(
+            model_name='favoriteevent',
+            name='expired',
+        ),
+        migrations.AddIndex(
+            model_name='favoriteevent',
+            index=models.Index(fields=['created'], name='favorite_event_created_idx'),
+        ),
+    ]
@@ -1,20 +1,127 @@
+import secrets
 from django.db import models
+from django.db.models import Avg, Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.shortcuts import reverse
 from django.contrib.auth.models import User
+from .similarity import MAX_CANDIDATES, estimate_similarity, get_buckets, get_signature
 
 # Create your models here.
+DIFFICULTY_RANKS = {
+    'Easy': 1,
+    'Medium': 2,
+    'Intermediate': 3,
+    'Hard': 4
+}
+
+# A fresh random value rather than a counter, so a pk reused after the database
+# is reset can't pick up a card cached for the old row
+def get_card_version():
+    return secrets.randbits(31)
+
+class RecipeQuerySet(models.QuerySet):
+    def difficulty_counts(self):
+        return (
+            self.order_by()
+            .values_list('difficulty')
+            .annotate(count=Count('pk'))
+            .order_by('-count', 'difficulty')
+        )
+
+    def cooking_time_by_ingredient_count(self):
+        return (
+            self.order_by()
+            .values_list('ingredient_count')
+            .annotate(cooking_time=Avg('cooking_time'), count=Count('pk'))
+            .order_by('ingredient_count')
+        )
+
+    # Only the columns a recipe card shows, leaving the ingredients, instructions
+    # and minhash in the database
+    def for_cards(self):
+        return self.only(*self.model.card_fields)
+
+    # Adds is_favorited for the given user to every row in the same query; favorite_count is already a column
+    def with_favorite_state(self, user):
+        if not user.is_authenticated:
+            return self.annotate(is_favorited=Value(False))
+
+        favorites = self.model.favorited_by.through.objects.filter(recipe_id=OuterRef('pk'), user_id=user.pk)
+        return self.annotate(is_favorited=Exists(favorites))
+
+    def refresh_favorite_counts(self):
+        favorites = (
+            self.model.favorited_by.through.objects.filter(recipe_id=OuterRef('pk'))
+            .order_by()
+            .values('recipe_id')
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        return self.update(favorite_count=Coalesce(Subquery(favorites), 0))
+
+class IngredientQuerySet(models.QuerySet):
+    def matching(self, term):
+        term = Ingredient.normalize(term)
+        if not term:
+            return self.none()
+
+        # The range lets the unique index on name narrow the prefix match on any collation
+        upper = term[:-1] + chr(ord(term[-1]) + 1)
+        return self.filter(name__gte=term, name__lt=upper, name__startswith=term)
+
+class Ingredient(models.Model):
+    name = models.CharField(max_length=120, unique=True)
+
+    objects = IngredientQuerySet.as_manager()
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(name.lower().split())[:120]
+
+    def __str__(self):
+        return f'Ingredient: {self.name}'
+
 class Recipe(models.Model):
     name = models.CharField(max_length=120)
     author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='recipes')
     ingredients = models.TextField(help_text='Enter each ingredient, separated by a comma')
+    ingredient_count = models.PositiveIntegerField(default=0, editable=False)
     cooking_time = models.IntegerField(help_text='In minutes')
     difficulty = models.CharField(max_length=20, blank=True)
+    difficulty_rank = models.PositiveSmallIntegerField(default=0, editable=False)
     instructions = models.TextField()
     pic = models.ImageField(upload_to='recipes', default='no_picture.jpg')
     favorited_by = models.ManyToManyField(User, related_name='favorite_recipes', blank=True)
+    ingredient_items = models.ManyToManyField(Ingredient, through='RecipeIngredient', related_name='recipes', blank=True)
+    minhash = models.BinaryField(null=True, editable=False)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    # Changes on every save, so cached cards are looked up by it and never go stale
+    version = models.PositiveIntegerField(default=get_card_version, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorite_count',)
+
+    # Includes difficulty_rank so a page sorted by difficulty can build its next cursor
+    card_fields = ('name', 'pic', 'cooking_time', 'difficulty', 'difficulty_rank', 'favorite_count', 'version')
+
+    # One index per sort order on the list page, each also led by difficulty_rank
+    # so the difficulty filter can narrow to a range already in that order
+    class Meta:
+        indexes = [
+            models.Index(fields=['cooking_time', 'id'], name='recipe_cooking_time_idx'),
+            models.Index(fields=['difficulty_rank', 'cooking_time', 'id'], name='recipe_difficulty_time_idx'),
+            models.Index(fields=['difficulty_rank', 'id'], name='recipe_difficulty_id_idx'),
+            models.Index(fields=['favorite_count', 'id'], name='recipe_favorites_idx'),
+            models.Index(fields=['difficulty_rank', 'favorite_count', 'id'], name='recipe_difficulty_favs_idx')
+        ]
+
+    @staticmethod
+    def split_ingredients(ingredients):
+        return [ingredient.strip() for ingredient in ingredients.split(',')]
 
     def set_difficulty(self):
-        ingredient_count = len(self.ingredients.split(','))
+        ingredient_count = len(self.split_ingredients(self.ingredients))
 
         if self.cooking_time < 10 and ingredient_count < 4:
             return 'Easy'
@@ -26,9 +133,94 @@ class Recipe(models.Model):
             return 'Hard'
         
     def save(self, *args, **kwargs):
+        if self.ingredients:
+            self.ingredient_count = len(self.split_ingredients(self.ingredients))
+
         if self.ingredients and self.cooking_time:
             self.difficulty = self.set_difficulty()
+        self.difficulty_rank = DIFFICULTY_RANKS.get(self.difficulty, 0)
+
+        update_fields = kwargs.get('update_fields')
+
+        # Counters only change through F() updates, so saving an instance loaded
+        # earlier mustn't write its stale copy back over them
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields and field.attname not in deferred
+            ]
+            kwargs['update_fields'] = update_fields
+
+        ingredients_changed = update_fields is None or 'ingredients' in update_fields
+        if ingredients_changed:
+            self.minhash = get_signature(self.get_ingredient_names())
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'minhash'}
+
+        self.version = get_card_version()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+
         super().save(*args, **kwargs)
+
+        if ingredients_changed:
+            self.sync_ingredients()
+            self.sync_buckets()
+
+    def get_ingredient_names(self):
+        names = [Ingredient.normalize(name) for name in self.split_ingredients(self.ingredients)]
+        return list(dict.fromkeys(name for name in names if name))
+
+    def sync_ingredients(self):
+        names = self.get_ingredient_names()
+
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], ignore_conflicts=True)
+        ingredient_ids = dict(Ingredient.objects.filter(name__in=names).values_list('name', 'pk'))
+
+        RecipeIngredient.objects.filter(recipe=self).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=self, ingredient_id=ingredient_ids[name], position=position)
+            for position, name in enumerate(names)
+        ])
+
+    def sync_buckets(self):
+        RecipeBucket.objects.filter(recipe=self).delete()
+        if self.minhash is not None:
+            RecipeBucket.objects.bulk_create([
+                RecipeBucket(recipe=self, band=band, bucket=bucket)
+                for band, bucket in get_buckets(self.minhash)
+            ])
+
+    # Other recipes' bucket rows that share a band bucket with this one; the only rows a lookup reads
+    def get_bucket_matches(self):
+        buckets = models.Q()
+        for band, bucket in get_buckets(self.minhash):
+            buckets |= models.Q(band=band, bucket=bucket)
+        return RecipeBucket.objects.filter(buckets).exclude(recipe_id=self.pk)
+
+    # Looks only at recipes sharing an LSH bucket, so the cost doesn't grow with the catalogue
+    def get_similar_recipes(self, limit=5, threshold=0.2):
+        if self.minhash is None:
+            return []
+
+        candidates = (
+            self.get_bucket_matches()
+            .values('recipe_id')
+            .annotate(shared=Count('id'))
+            .order_by('-shared', 'recipe_id')
+            .values_list('recipe_id', flat=True)[:MAX_CANDIDATES]
+        )
+
+        scored = []
+        for recipe in Recipe.objects.filter(pk__in=list(candidates)).only('name', 'cooking_time', 'difficulty', 'pic', 'minhash'):
+            similarity = estimate_similarity(self.minhash, recipe.minhash)
+            if similarity >= threshold:
+                recipe.similarity = similarity
+                scored.append(recipe)
+
+        scored.sort(key=lambda recipe: (-recipe.similarity, recipe.pk))
+        return scored[:limit]
     
     def __str__(self):
         return f'Recipe: {self.name}'
@@ -37,4 +229,97 @@ class Recipe(models.Model):
         return reverse('recipes:detail', kwargs={'pk': self.pk})
     
     def get_ingredients_list(self):
-        return[ingredient.strip() for ingredient in self.ingredients.split(',')]
\ No newline at end of file
+        return self.split_ingredients(self.ingredients)
+
+class RecipeIngredient(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='recipe_ingredients')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='recipe_ingredients')
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['recipe', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'ingredient'], name='unique_recipe_ingredient')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe.name}: {self.ingredient.name}'
+
+class RecipeBucket(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='buckets')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket'], name='recipe_bucket_lookup')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: band {self.band}'
+
+# A favorite added (delta 1) or removed (delta -1), kept so trending counts can be
+# worked out over a sliding window; events that have left it are deleted
+class FavoriteEvent(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='favorite_events')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='favorite_events')
+    delta = models.SmallIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created'], name='favorite_event_created_idx'),
+            models.Index(fields=['recipe', 'created'], name='favorite_event_recipe_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.delta:+d} at {self.created}'
+
+# Net favorites each recipe gained inside the trending window, kept up to date as
+# favorites change so the leaderboard is a read of an index
+class RecipeTrend(models.Model):
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    recent_favorites = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recent_favorites', 'recipe'], name='recipe_trend_rank_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.recent_favorites} recent favorites'
+
+# One row per kind of change. Each worker remembers the values it last saw and
+# drops its in-memory caches when one moves, so workers never need to talk directly
+class CacheGeneration(models.Model):
+    RECIPES = 'recipes'
+    FAVORITES = 'favorites'
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+class ChartJob(models.Model):
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed')
+    )
+
+    # The chart's key from get_chart_key, a hash of its format and plotted values
+    id = models.CharField(primary_key=True, max_length=64)
+    chart_type = models.CharField(max_length=2)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    series = models.JSONField(null=True, blank=True)
+    image = models.BinaryField(blank=True)
+    content_type = models.CharField(max_length=50, default='image/png')
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'Chart job: {self.pk} ({self.status})'
@@ -0,0 +1,53 @@
+from functools import wraps
+import hashlib
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from .generations import get_generations
+from .models import CacheGeneration
+from .pagination import is_fragment_request
+
+# Every anonymous page depends on the recipes and on their favorite counts
+def get_catalogue_generation(request):
+    generations = get_generations(request)
+    current = [generations[name] for name in (CacheGeneration.RECIPES, CacheGeneration.FAVORITES) if name in generations]
+    generation = ':'.join(str(value) for value, updated in current)
+    modified = max((int(updated.timestamp()) for value, updated in current), default=0)
+    return generation, modified
+
+# Serves anonymous visitors a copy rendered for the current catalogue generation,
+# or a 304 when their copy is still current. Logged in users always get a fresh
+# render, since their pages show their own favorites
+def cache_anonymous_page(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        generation, modified = get_catalogue_generation(request)
+        key = hashlib.sha256(
+            f'{generation}:{int(is_fragment_request(request))}:{request.get_full_path()}'.encode('utf-8')
+        ).hexdigest()
+        etag = f'"{key[:32]}"'
+
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            cached = caches['pages'].get(f'page:{key}')
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                caches['pages'].set(f'page:{key}', (response.content, response['Content-Type']))
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        # Browsers must check back each visit, and never reuse the page once logged in
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'X-Requested-With'))
+        return response
+
+    return wrapper
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Integers outside a signed 64 bit column overflow the database driver
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+    # Cursors only ever hold the ints and strings of the ordering's columns; floats such
+    # as 1e300 or Infinity would be turned into ints too big for the driver
+    for value in values:
+        if not isinstance(value, (int, str)) or isinstance(value, int) and not MIN_INTEGER <= value <= MAX_INTEGER:
+            return None
+    return values
+
+def is_fragment_request(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def get_next_url(self, request, param='cursor'):
+        if not self.has_next():
+            return None
+        query = request.GET.copy()
+        query[param] = self.next_cursor
+        return f'?{query.urlencode()}'
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+# Pages through a queryset by the values of its last row rather than an OFFSET,
+# so every page costs the same however deep it is. The ordering must end in a
+# unique field, and each page fetches one extra row to know whether another follows
+class KeysetPaginator:
+    def __init__(self, queryset, ordering=('pk',), page_size=None):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.page_size = page_size or getattr(settings, 'RECIPES_PAGE_SIZE', 24)
+        self.fields = [field.lstrip('-') for field in ordering]
+
+    # Rows after the cursor, written as a >= x AND (a > x OR (b >= y AND ...)) so the
+    # leading column is a plain range the ordering's index can seek to
+    def get_after(self, values, start=0):
+        field = self.fields[start]
+        descending = self.ordering[start].startswith('-')
+        after = Q(**{f'{field}__{"lt" if descending else "gt"}': values[start]})
+        if start == len(self.fields) - 1:
+            return after
+
+        from_value = Q(**{f'{field}__{"lte" if descending else "gte"}': values[start]})
+        return from_value & (after | self.get_after(values, start + 1))
+
+    def get_page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+
+        values = decode_cursor(cursor) if cursor else None
+        # A cursor that doesn't fit the ordering starts again from the first page
+        if values is not None and len(values) == len(self.fields):
+            try:
+                queryset = queryset.filter(self.get_after(values))
+            except (TypeError, ValueError, ValidationError):
+                pass
+
+        object_list = list(queryset[:self.page_size + 1])
+        next_cursor = None
+        if len(object_list) > self.page_size:
+            object_list = object_list[:self.page_size]
+            last = object_list[-1]
+            next_cursor = encode_cursor([getattr(last, field) for field in self.fields])
+
+        return KeysetPage(object_list, next_cursor)
@@ -0,0 +1,72 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Recipe, FavoriteEvent, RecipeTrend
+
+def get_trending_cutoff():
+    return timezone.now() - timedelta(days=settings.TRENDING_DAYS)
+
+# Logs favorites added (delta 1) or removed (delta -1) as (recipe id, user id)
+# pairs and moves each recipe's trending count by the same amount
+def record_favorite_events(pairs, delta):
+    pairs = list(pairs)
+    if not pairs:
+        return
+
+    FavoriteEvent.objects.bulk_create([
+        FavoriteEvent(recipe_id=recipe_id, user_id=user_id, delta=delta) for recipe_id, user_id in pairs
+    ])
+
+    counts = Counter(recipe_id for recipe_id, user_id in pairs)
+    RecipeTrend.objects.bulk_create([RecipeTrend(recipe_id=recipe_id) for recipe_id in counts], ignore_conflicts=True)
+    for recipe_id, count in counts.items():
+        RecipeTrend.objects.filter(recipe_id=recipe_id).update(recent_favorites=F('recent_favorites') + delta * count)
+
+# Deletes events that have left the window, a batch at a time so a backlog can't
+# hold one request up, and recounts their recipes from the events still inside
+# it. Recounting rather than subtracting means running this twice, or from two
+# requests at once, can't take the same events off twice
+def expire_favorite_events(batch_size=1000):
+    cutoff = get_trending_cutoff()
+    expiring = list(
+        FavoriteEvent.objects.filter(created__lt=cutoff).order_by('created').values_list('pk', 'recipe_id')[:batch_size]
+    )
+    if not expiring:
+        return 0
+
+    FavoriteEvent.objects.filter(pk__in=[pk for pk, recipe_id in expiring]).delete()
+    recipe_ids = {recipe_id for pk, recipe_id in expiring}
+
+    recent = (
+        FavoriteEvent.objects.filter(recipe_id=OuterRef('recipe_id'), created__gte=cutoff)
+        .order_by()
+        .values('recipe_id')
+        .annotate(total=Sum('delta'))
+        .values('total')
+    )
+    RecipeTrend.objects.filter(recipe_id__in=recipe_ids).update(recent_favorites=Coalesce(Subquery(recent), 0))
+    return len(recipe_ids)
+
+def get_most_favorited(limit=None):
+    limit = limit or settings.LEADERBOARD_SIZE
+    return list(Recipe.objects.for_cards().filter(favorite_count__gt=0).order_by('-favorite_count', '-pk')[:limit])
+
+def get_trending(limit=None):
+    limit = limit or settings.LEADERBOARD_SIZE
+    expire_favorite_events()
+
+    trends = (
+        RecipeTrend.objects.filter(recent_favorites__gt=0)
+        .select_related('recipe')
+        .only('recent_favorites', *[f'recipe__{field}' for field in Recipe.card_fields])
+        .order_by('-recent_favorites', '-recipe')[:limit]
+    )
+
+    recipes = []
+    for trend in trends:
+        trend.recipe.recent_favorites = trend.recent_favorites
+        recipes.append(trend.recipe)
+    return recipes
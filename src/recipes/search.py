@@ -0,0 +1,146 @@
+import json
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Ingredient, RecipeIngredient
+
+FTS_TABLE = 'recipes_recipe_fts'
+
+def get_terms(text):
+    return re.findall(r'\w+', text.lower()) if text else []
+
+# Ingredients are looked up by prefix in the normalised Ingredient table on every
+# database, so 'salt' matches 'salt' and 'salted peanuts' but not 'unsalted butter'
+def filter_ingredient(qs, ingredient):
+    if not ingredient:
+        return qs
+
+    matches = RecipeIngredient.objects.filter(ingredient__in=Ingredient.objects.matching(ingredient))
+    return qs.filter(pk__in=matches.values('recipe_id'))
+
+# Plain substring matching, used on databases without a full-text index
+class SearchBackend:
+    def filter(self, qs, name='', ingredient='', keywords=''):
+        qs = filter_ingredient(qs, ingredient)
+
+        if name:
+            qs = qs.filter(name__icontains=name)
+
+        if keywords:
+            qs = qs.filter(
+                Q(name__icontains=keywords) |
+                Q(ingredients__icontains=keywords) |
+                Q(instructions__icontains=keywords)
+            )
+
+        return qs
+
+    def rank(self, qs, name='', ingredient='', keywords=''):
+        return qs
+
+    def filter_pks(self, qs, pks):
+        return qs.filter(pk__in=pks)
+
+    def index(self, recipe):
+        pass
+
+    def remove(self, pk):
+        pass
+
+    def rebuild(self):
+        pass
+
+# SQLite FTS5 table mirroring name, ingredients and instructions, keyed on the recipe id
+class SQLiteSearchBackend(SearchBackend):
+    def get_match(self, name='', keywords=''):
+        clauses = []
+
+        for column, text in (('name', name), (None, keywords)):
+            terms = get_terms(text)
+            if terms:
+                phrases = ' '.join(f'"{term}"*' for term in terms)
+                clauses.append(f'{column} : ({phrases})' if column else f'({phrases})')
+
+        return ' AND '.join(clauses)
+
+    def filter(self, qs, name='', ingredient='', keywords=''):
+        qs = filter_ingredient(qs, ingredient)
+
+        match = self.get_match(name, keywords)
+        if not match:
+            return qs
+
+        return qs.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+
+    def rank(self, qs, name='', ingredient='', keywords=''):
+        match = self.get_match(name, keywords)
+        if not match:
+            return qs
+
+        # Joined rather than looked up per row, so FTS5 runs the MATCH once however many rows match
+        ranked = qs.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = recipes_recipe.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match]
+        )
+        return ranked.order_by(RawSQL(f'{FTS_TABLE}.rank', []).asc(), 'pk')
+
+    # Passed as one JSON array rather than a parameter per id, which SQLite caps
+    def filter_pks(self, qs, pks):
+        return qs.filter(pk__in=RawSQL('SELECT value FROM json_each(%s)', [json.dumps(pks)]))
+
+    def index(self, recipe):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [recipe.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, instructions) VALUES (%s, %s, %s, %s)',
+                [recipe.pk, recipe.name, recipe.ingredients, recipe.instructions]
+            )
+
+    def remove(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, instructions) '
+                'SELECT id, name, ingredients, instructions FROM recipes_recipe'
+            )
+
+# Postgres keeps a generated tsvector column up to date itself, and pg_trgm
+# indexes let the substring filters on name and ingredients use an index
+class PostgresSearchBackend(SearchBackend):
+    def filter(self, qs, name='', ingredient='', keywords=''):
+        qs = super().filter(qs, name, ingredient)
+
+        if keywords:
+            qs = qs.filter(pk__in=RawSQL(
+                "SELECT id FROM recipes_recipe WHERE search_vector @@ plainto_tsquery('english', %s)",
+                [keywords]
+            ))
+
+        return qs
+
+    def rank(self, qs, name='', ingredient='', keywords=''):
+        text = ' '.join(term for term in (name, ingredient, keywords) if term)
+        if not text:
+            return qs
+
+        rank = RawSQL(
+            """ts_rank("recipes_recipe"."search_vector", plainto_tsquery('english', %s))""",
+            [text]
+        )
+        return qs.annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+    def filter_pks(self, qs, pks):
+        return qs.filter(pk__in=RawSQL('SELECT unnest(%s::bigint[])', [list(pks)]))
+
+def get_search_backend():
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SearchBackend()
@@ -0,0 +1,73 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+from .models import Recipe, CacheGeneration
+from .search import get_search_backend
+from .indexes import ingredient_index
+from .generations import bump_generation, register_invalidator
+from .rankings import record_favorite_events
+
+@receiver([post_save, post_delete], sender=Recipe)
+def bump_recipe_generation(sender, **kwargs):
+    bump_generation(CacheGeneration.RECIPES)
+
+# Other workers learn of recipe changes through the generation table
+register_invalidator(CacheGeneration.RECIPES, ingredient_index.invalidate)
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    get_search_backend().index(instance)
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def update_ingredient_index(sender, instance, **kwargs):
+    ingredient_index.update(instance)
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_ingredient_index(sender, instance, **kwargs):
+    ingredient_index.remove(instance.pk)
+
+
+def get_favorite_pairs(instance, reverse, pk_set=None):
+    field, other = ('user_id', 'recipe_id') if reverse else ('recipe_id', 'user_id')
+    favorites = Recipe.favorited_by.through.objects.filter(**{field: instance.pk})
+    if pk_set is not None:
+        favorites = favorites.filter(**{f'{other}__in': pk_set})
+    return list(favorites.values_list('recipe_id', 'user_id'))
+
+# Keeps Recipe.favorite_count, which the list page sorts on, in step with favorited_by
+# and logs each change for the trending leaderboard. Removals are looked up before
+# they happen, since pk_set holds whatever ids were passed rather than what existed
+@receiver(m2m_changed, sender=Recipe.favorited_by.through)
+def update_favorite_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        instance._removed_favorites = get_favorite_pairs(instance, reverse, pk_set)
+        return
+
+    if action == 'post_add':
+        pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        record_favorite_events(pairs, 1)
+    elif action in ('post_remove', 'post_clear'):
+        pairs = instance.__dict__.pop('_removed_favorites', [])
+        record_favorite_events(pairs, -1)
+    else:
+        return
+
+    Recipe.objects.filter(pk__in={recipe_id for recipe_id, user_id in pairs}).refresh_favorite_counts()
+    bump_generation(CacheGeneration.FAVORITES)
+
+# Deleting a user removes their favorites without an m2m_changed signal
+@receiver(pre_delete, sender=User)
+def remember_deleted_favorites(sender, instance, **kwargs):
+    instance._deleted_favorites = list(instance.favorite_recipes.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=User)
+def update_deleted_favorite_counts(sender, instance, **kwargs):
+    pks = instance.__dict__.pop('_deleted_favorites', [])
+    record_favorite_events([(pk, None) for pk in pks], -1)
+    Recipe.objects.filter(pk__in=pks).refresh_favorite_counts()
+    bump_generation(CacheGeneration.FAVORITES)
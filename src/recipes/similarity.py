@@ -0,0 +1,54 @@
+import hashlib
+import random
+import struct
+
+# 16 bands of 4 rows: recipes at 0.5 similarity share a band about two times in three,
+# at 0.1 about one time in 600, so a bucket holds near matches rather than a growing
+# share of the catalogue. Changing these needs the buckets rebuilt (backfill_minhash)
+NUM_HASHES = 64
+ROWS_PER_BAND = 4
+BANDS = NUM_HASHES // ROWS_PER_BAND
+
+# Recipes sharing a band bucket are candidates; only the most promising are compared
+MAX_CANDIDATES = 50
+
+# 2**61 - 1, so (a * x + b) % PRIME is a universal hash for 32 bit x
+PRIME = (1 << 61) - 1
+
+_random = random.Random(20240101)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for i in range(NUM_HASHES)]
+
+SIGNATURE_FORMAT = f'<{NUM_HASHES}I'
+
+def hash_name(name):
+    return int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=4).digest(), 'little')
+
+# The minimum of each of NUM_HASHES hash functions over the ingredient names;
+# two signatures agree in a slot with probability equal to the sets' Jaccard similarity
+def get_signature(names):
+    hashes = [hash_name(name) for name in set(names)]
+    if not hashes:
+        return None
+
+    signature = [min((a * x + b) % PRIME for x in hashes) & 0xFFFFFFFF for a, b in PERMUTATIONS]
+    return struct.pack(SIGNATURE_FORMAT, *signature)
+
+def unpack_signature(signature):
+    return struct.unpack(SIGNATURE_FORMAT, bytes(signature))
+
+# One bucket per band, so recipes whose signatures agree on every row of any band collide
+def get_buckets(signature):
+    values = unpack_signature(signature)
+    buckets = []
+    for band in range(BANDS):
+        rows = values[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f'<{ROWS_PER_BAND}I', *rows), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+def estimate_similarity(signature, other):
+    return sum(a == b for a, b in zip(unpack_signature(signature), unpack_signature(other))) / NUM_HASHES
+
+# Takes (pk, ingredient names) pairs so it can run in a worker process
+def get_signatures(recipes):
+    return [(pk, get_signature(names)) for pk, names in recipes]
@@ -0,0 +1,50 @@
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.querySelector('.chart-container[data-chart-url]');
+
+    if (container) {
+        const img = container.querySelector('img');
+        const status = container.querySelector('.chart-status');
+        const url = container.dataset.chartUrl;
+        // Waits 0.5s, 1s, 2s, ... up to 8s between polls, then gives up
+        const maxAttempts = 15;
+        const maxDelay = 8000;
+        let attempts = 0;
+        let delay = 500;
+
+        const fail = () => {
+            status.textContent = 'Chart could not be generated';
+        };
+
+        const poll = () => {
+            attempts += 1;
+            fetch(url, {
+                headers: {
+                    'X-Requested-With': 'XMLHttpRequest'
+                }
+            })
+            .then(response => {
+                if (response.status === 202) {
+                    if (attempts < maxAttempts) {
+                        setTimeout(poll, delay);
+                        delay = Math.min(delay * 2, maxDelay);
+                    } else {
+                        fail();
+                    }
+                } else if (response.ok) {
+                    // The chart is now in the browser cache, so this doesn't download it again
+                    img.src = url;
+                    img.hidden = false;
+                    status.remove();
+                } else {
+                    fail();
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                fail();
+            });
+        };
+
+        poll();
+    }
+});
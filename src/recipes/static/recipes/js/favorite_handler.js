@@ -2,10 +2,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const favoriteForm = document.querySelector('.favorite-form');
 
     if (favoriteForm) {
-        favorite.Form.addEventListener('submit', (e) => {
+        favoriteForm.addEventListener('submit', (e) => {
             e.preventDefault();
 
-            const btn = favorite.Form.querySelector('.favorite-btn');
+            const btn = favoriteForm.querySelector('.favorite-btn');
             const url = favoriteForm.getAttribute('action');
             const csrfToken = favoriteForm.querySelector('[name=csrfmiddlewaretoken]').value;
 
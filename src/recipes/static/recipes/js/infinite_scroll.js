@@ -0,0 +1,55 @@
+document.addEventListener('DOMContentLoaded', () => {
+    const observer = new IntersectionObserver((entries) => {
+        entries.forEach((entry) => {
+            if (entry.isIntersecting) {
+                loadPage(entry.target);
+            }
+        });
+    }, { rootMargin: '300px' });
+
+    // The link still works as a plain next page link without JavaScript
+    const watch = (link) => {
+        link.addEventListener('click', (e) => {
+            e.preventDefault();
+            loadPage(link);
+        });
+        observer.observe(link);
+    };
+
+    const loadPage = (link) => {
+        if (link.dataset.loading) {
+            return;
+        }
+        link.dataset.loading = 'true';
+        observer.unobserve(link);
+
+        fetch(link.href, {
+            headers: { 'X-Requested-With': 'XMLHttpRequest' }
+        })
+        .then(response => response.text())
+        .then(html => {
+            const page = document.createElement('template');
+            page.innerHTML = html;
+
+            const next = page.content.querySelector('.load-more');
+            if (next) {
+                next.remove();
+            }
+
+            document.querySelector(link.dataset.target).append(page.content);
+
+            if (next) {
+                link.replaceWith(next);
+                watch(next);
+            } else {
+                link.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            delete link.dataset.loading;
+        });
+    };
+
+    document.querySelectorAll('.load-more').forEach(watch);
+});
\ No newline at end of file
@@ -0,0 +1,26 @@
+from django.urls import reverse
+from django.utils.html import escape
+
+HEADER = (
+    '<table class="results-table">\n'
+    '<thead>\n<tr><th>Name</th><th>Cooking Time</th><th>Difficulty</th></tr>\n</thead>\n'
+    '<tbody>\n'
+)
+FOOTER = '</tbody>\n</table>'
+
+# Yields the search results table a row at a time from (pk, name, cooking time,
+# difficulty) tuples, escaping the text. The detail URL is reversed once and the
+# pk spliced in, rather than resolving the URLconf for every row
+def iter_results_table(rows):
+    url_start, url_end = reverse('recipes:detail', kwargs={'pk': 'PK'}).split('PK')
+
+    yield HEADER
+    for pk, name, cooking_time, difficulty in rows:
+        yield (
+            f'<tr><td><a href="{url_start}{int(pk)}{url_end}">{escape(name)}</a></td>'
+            f'<td>{int(cooking_time)} min</td><td>{escape(difficulty)}</td></tr>\n'
+        )
+    yield FOOTER
+
+def render_results_table(rows):
+    return ''.join(iter_results_table(rows))
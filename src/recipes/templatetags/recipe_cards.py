@@ -0,0 +1,9 @@
+from django import template
+from django.utils.safestring import mark_safe
+from .. import cards
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def recipe_cards(context, recipes, template_name='recipes/_recipe_card.html'):
+    return mark_safe(cards.render_cards(recipes, template_name, context.get('user')))
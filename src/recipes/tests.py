@@ -1,11 +1,63 @@
-from django.test import TestCase, Client
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings, tag
+from unittest import skipUnless
+from unittest.mock import patch
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import threading
 from django.urls import reverse, resolve
+from django.conf import settings
 from django.contrib.auth.models import User
-import pandas as pd
-from .models import Recipe
+import gc
+import os
+import random
+import shutil
+import subprocess
+import re
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from django.utils import timezone
+from django.db import connection, OperationalError
+from django.db.models import F
+from django.core.cache import caches
+from django.db.models.signals import post_init
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from io import StringIO
+from .models import Recipe, ChartJob, Ingredient, RecipeIngredient, RecipeBucket, FavoriteEvent, RecipeTrend, CacheGeneration
 from .views import home, RecipeListView, RecipeDetailView, search
 from .forms import RecipesSearchForm, CHART_CHOICES, DIFFICULTY_CHOICES
-from .utils import get_chart
+from .utils import get_chart_key, plot_chart, render_chart, render_svg, chart_cache, top_bars, bin_points, bar_series, pie_series, line_series
+from .jobs import get_executor, submit_chart_job, finish_chart_job
+from .search import get_search_backend, FTS_TABLE
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .indexes import IngredientIndex, ingredient_index, parse_ingredient_query
+from .tables import iter_results_table, render_results_table
+from .cache_backends import PeriodicCullFileBasedCache
+from .management.commands.benchmark_results_table import get_rows as get_benchmark_rows, measure, render_pandas_table
+from .generations import check_generations
+from .rankings import expire_favorite_events, get_most_favorited, get_trending
+from .similarity import BANDS, estimate_similarity, get_signature
+
+# Rolling back a test's transaction returns the generations to values pages were
+# already cached under, so tests get page and search caches that keep nothing.
+# Cards are cached by the real backend, in a directory of this run's own rather
+# than the machine's CACHE_DIR
+test_cache_dir = tempfile.mkdtemp(prefix='recipe-tests-')
+test_caches = override_settings(CACHES=dict(
+    settings.CACHES,
+    cards=dict(settings.CACHES['cards'], LOCATION=os.path.join(test_cache_dir, 'cards')),
+    pages={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    search={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+))
+
+def setUpModule():
+    test_caches.enable()
+
+def tearDownModule():
+    test_caches.disable()
+    shutil.rmtree(test_cache_dir, ignore_errors=True)
 
 # Create your tests here.
 class RecipeModelTest(TestCase):
@@ -101,6 +153,22 @@ class RecipeModelTest(TestCase):
         ingredients = self.easy_recipe.get_ingredients_list()
         self.assertEqual(ingredients, ['eggs', 'butter', 'salt'])
     
+    def test_ingredient_count_stored_on_save(self):
+        self.assertEqual(self.easy_recipe.ingredient_count, 3)
+        self.assertEqual(self.hard_recipe.ingredient_count, 5)
+
+    def test_difficulty_counts(self):
+        counts = list(Recipe.objects.difficulty_counts())
+        self.assertEqual(sorted(counts), [('Easy', 1), ('Hard', 1), ('Intermediate', 1), ('Medium', 1)])
+
+    def test_cooking_time_by_ingredient_count(self):
+        averages = list(Recipe.objects.cooking_time_by_ingredient_count())
+        self.assertEqual(averages, [(3, 12.5, 2), (4, 5.0, 1), (5, 60.0, 1)])
+
+    def test_aggregations_respect_filters(self):
+        counts = list(Recipe.objects.filter(cooking_time__lt=10).difficulty_counts())
+        self.assertEqual(sorted(counts), [('Easy', 1), ('Medium', 1)])
+
     def test_get_ingredients_list_strips_whitespace(self):
         recipe = Recipe.objects.create(
             name = 'Whitespace Test',
@@ -154,6 +222,15 @@ class RecipesSearchFormTest(TestCase):
         form = RecipesSearchForm()
         self.assertEqual(form.fields['chart_type'].choices, list(CHART_CHOICES))
 
+    def test_ingredient_query_valid(self):
+        form = RecipesSearchForm(data={'ingredient_query': 'chicken AND garlic NOT dairy', 'chart_type': '#1'})
+        self.assertTrue(form.is_valid())
+
+    def test_ingredient_query_malformed(self):
+        form = RecipesSearchForm(data={'ingredient_query': 'chicken AND', 'chart_type': '#1'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('ingredient_query', form.errors)
+
 
 # URL Tests
 class RecipeURLTests(TestCase):
@@ -334,6 +411,839 @@ class RecipeListViewEmptyTest(TestCase):
         response = self.client.get('/list/')
         self.assertContains(response, 'No recipes added yet')
 
+# Pagination Tests
+@override_settings(RECIPES_PAGE_SIZE=2)
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'Paged Recipe {i}',
+                ingredients='a, b',
+                cooking_time=5 + i,
+                instructions='Cook',
+                author=cls.user
+            )
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_pages_follow_cursor(self):
+        paginator = KeysetPaginator(Recipe.objects.all())
+        seen = []
+        cursor = None
+        while True:
+            page = paginator.get_page(cursor)
+            seen.extend(recipe.pk for recipe in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, [recipe.pk for recipe in self.recipes])
+
+    def test_descending_multi_field_ordering(self):
+        Recipe.objects.filter(pk=self.recipes[1].pk).update(cooking_time=9)
+        paginator = KeysetPaginator(Recipe.objects.all(), ordering=('-cooking_time', 'pk'), page_size=2)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        names = [recipe.name for page in (first, second, third) for recipe in page]
+        self.assertEqual(names, [
+            'Paged Recipe 1', 'Paged Recipe 4', 'Paged Recipe 3', 'Paged Recipe 2', 'Paged Recipe 0'
+        ])
+
+    def test_no_offset_on_deep_pages(self):
+        page = KeysetPaginator(Recipe.objects.all()).get_page(encode_cursor([self.recipes[2].pk]))
+        with CaptureQueriesContext(connection) as queries:
+            KeysetPaginator(Recipe.objects.all()).get_page(page.next_cursor)
+        self.assertNotIn('OFFSET', queries.captured_queries[0]['sql'])
+
+    def test_invalid_cursor_starts_from_first_page(self):
+        self.assertIsNone(decode_cursor('not a cursor'))
+        page = KeysetPaginator(Recipe.objects.all()).get_page(encode_cursor(['x']))
+        self.assertEqual(page.object_list[0], self.recipes[0])
+
+    def test_out_of_range_cursor_starts_from_first_page(self):
+        self.assertIsNone(decode_cursor(encode_cursor([10 ** 30])))
+        self.assertIsNone(decode_cursor(encode_cursor([1e300])))
+        self.assertIsNone(decode_cursor(encode_cursor([float('inf')])))
+        self.assertIsNone(decode_cursor(encode_cursor([float('nan')])))
+        for url in ('/', '/list/'):
+            for cursor in ('WzFlMzAwXQ', encode_cursor([float('inf')]), encode_cursor([float('-inf'), 1])):
+                with self.subTest(url=url, cursor=cursor):
+                    self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 200)
+                    self.assertEqual(self.client.get(url, {'cursor': cursor, 'sort': 'cooking_time'}).status_code, 200)
+        for params in ({'cursor': encode_cursor([10 ** 30])}, {'cursor': encode_cursor([10 ** 30, 1]), 'sort': 'cooking_time'}):
+            response = self.client.get('/list/', params)
+            self.assertEqual(response.status_code, 200)
+            first_page = self.client.get('/list/', {'sort': params.get('sort', '')})
+            self.assertEqual(list(response.context['recipes']), list(first_page.context['recipes']))
+
+    def test_list_view_paginated(self):
+        response = self.client.get('/list/')
+        self.assertEqual(len(response.context['recipes']), 2)
+        self.assertContains(response, 'Load more recipes')
+        self.assertContains(response, 'infinite_scroll.js')
+
+    def test_list_view_fragment(self):
+        next_url = self.client.get('/list/').context['next_url']
+        response = self.client.get(f'/list/{next_url}', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateUsed(response, 'recipes/_recipe_page.html')
+        self.assertTemplateNotUsed(response, 'recipes/base.html')
+        self.assertContains(response, 'Paged Recipe 2')
+        self.assertNotContains(response, 'Paged Recipe 0')
+
+    def test_last_page_has_no_load_more(self):
+        cursor = encode_cursor([self.recipes[2].pk])
+        response = self.client.get('/list/', {'cursor': cursor})
+        self.assertContains(response, 'Paged Recipe 0')
+        self.assertNotContains(response, 'Load more recipes')
+
+    def test_home_view_paginated(self):
+        response = self.client.get('/')
+        self.assertEqual(len(response.context['recipes']), 2)
+        response = self.client.get(f'/{response.context["next_url"]}', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateUsed(response, 'recipes/_home_card.html')
+        self.assertContains(response, 'Paged Recipe 2')
+
+    def test_profile_lists_scroll_independently(self):
+        self.recipes[0].favorited_by.add(self.user)
+        response = self.client.get(reverse('recipes:profile'))
+        self.assertEqual(len(response.context['authored_recipes']), 2)
+        self.assertEqual(len(response.context['favorite_recipes']), 1)
+        self.assertIsNone(response.context['favorites_next_url'])
+
+        response = self.client.get(
+            reverse('recipes:profile') + response.context['authored_next_url'],
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertContains(response, 'Paged Recipe 3')
+        self.assertContains(response, 'data-target="#authored-grid"')
+
+class RecipeListSortTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.other = User.objects.create_user(
+            username='otheruser',
+            password='testpass123'
+        )
+        cls.stew = Recipe.objects.create(name='Stew', ingredients='a, b, c, d', cooking_time=90, instructions='Simmer')
+        cls.toast = Recipe.objects.create(name='Toast', ingredients='bread', cooking_time=3, instructions='Toast')
+        cls.salad = Recipe.objects.create(name='Salad', ingredients='a, b, c, d', cooking_time=5, instructions='Toss')
+        cls.rice = Recipe.objects.create(name='Rice', ingredients='rice, water', cooking_time=20, instructions='Boil')
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def names(self, **params):
+        response = self.client.get('/list/', params)
+        return [recipe.name for recipe in response.context['recipes']]
+
+    def test_difficulty_rank_set_on_save(self):
+        self.assertEqual((self.toast.difficulty, self.toast.difficulty_rank), ('Easy', 1))
+        self.assertEqual((self.stew.difficulty, self.stew.difficulty_rank), ('Hard', 4))
+
+    def test_default_sort_is_newest(self):
+        self.assertEqual(self.names(), ['Rice', 'Salad', 'Toast', 'Stew'])
+
+    def test_sort_by_cooking_time(self):
+        self.assertEqual(self.names(sort='cooking_time'), ['Toast', 'Salad', 'Rice', 'Stew'])
+
+    def test_sort_by_difficulty(self):
+        self.assertEqual(self.names(sort='difficulty'), ['Toast', 'Salad', 'Rice', 'Stew'])
+
+    def test_sort_by_most_favorited(self):
+        self.rice.favorited_by.add(self.user, self.other)
+        self.other.favorite_recipes.add(self.toast)
+        self.assertEqual(self.names(sort='favorites'), ['Rice', 'Toast', 'Salad', 'Stew'])
+
+    def test_filters(self):
+        self.assertEqual(self.names(difficulty='Medium'), ['Salad'])
+        self.assertEqual(self.names(max_cooking_time=20, sort='cooking_time'), ['Toast', 'Salad', 'Rice'])
+        self.assertEqual(self.names(difficulty='Intermediate', max_cooking_time=10), [])
+
+    def test_invalid_filters_ignored(self):
+        response = self.client.get('/list/', {'max_cooking_time': 0, 'sort': 'bogus'})
+        self.assertEqual(len(response.context['recipes']), 4)
+        self.assertTrue(response.context['filter_form'].errors)
+
+    def test_no_matches_message(self):
+        response = self.client.get('/list/', {'max_cooking_time': 1})
+        self.assertContains(response, 'No recipes match these filters')
+
+    @override_settings(RECIPES_PAGE_SIZE=1)
+    def test_next_page_keeps_sort_and_filters(self):
+        response = self.client.get('/list/', {'sort': 'cooking_time', 'max_cooking_time': 20})
+        response = self.client.get('/list/' + response.context['next_url'])
+        self.assertEqual([recipe.name for recipe in response.context['recipes']], ['Salad'])
+
+    def test_favorite_count_follows_favorites(self):
+        def count(recipe):
+            recipe.refresh_from_db()
+            return recipe.favorite_count
+
+        self.stew.favorited_by.add(self.user, self.other)
+        self.assertEqual(count(self.stew), 2)
+        self.stew.favorited_by.remove(self.user)
+        self.assertEqual(count(self.stew), 1)
+        self.stew.favorited_by.clear()
+        self.assertEqual(count(self.stew), 0)
+
+        self.other.favorite_recipes.add(self.stew, self.salad)
+        self.assertEqual(count(self.salad), 1)
+        self.other.favorite_recipes.clear()
+        self.assertEqual((count(self.stew), count(self.salad)), (0, 0))
+
+        self.other.favorite_recipes.add(self.salad)
+        self.other.delete()
+        self.assertEqual(count(self.salad), 0)
+
+class FavoriteToggleTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.recipe = Recipe.objects.create(name='Popular Pie', ingredients='a, b', cooking_time=30, instructions='Bake')
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+        self.url = reverse('recipes:favorite', kwargs={'pk': self.recipe.pk})
+
+    def toggle(self):
+        return self.client.post(self.url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()['is_favorited']
+
+    def favorite_count(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.favorite_count
+
+    def test_toggle_on_and_off(self):
+        self.assertTrue(self.toggle())
+        self.assertEqual(self.favorite_count(), 1)
+        self.assertTrue(self.recipe.favorited_by.filter(pk=self.user.pk).exists())
+
+        self.assertFalse(self.toggle())
+        self.assertEqual(self.favorite_count(), 0)
+        self.assertFalse(self.recipe.favorited_by.filter(pk=self.user.pk).exists())
+
+    def test_redirects_without_javascript(self):
+        response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('recipes:detail', kwargs={'pk': self.recipe.pk}))
+
+    def test_missing_recipe(self):
+        response = self.client.post(reverse('recipes:favorite', kwargs={'pk': 9999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_independent_of_popularity(self):
+        with CaptureQueriesContext(connection) as quiet:
+            self.toggle()
+        self.toggle()
+
+        fans = User.objects.bulk_create([User(username=f'fan{i}') for i in range(50)])
+        Recipe.favorited_by.through.objects.bulk_create([
+            Recipe.favorited_by.through(recipe=self.recipe, user=fan) for fan in fans
+        ])
+
+        with CaptureQueriesContext(connection) as popular:
+            self.toggle()
+        self.assertEqual(len(popular), len(quiet))
+        self.assertFalse(any('JOIN "recipes_recipe_favorited_by"' in query['sql'] for query in popular.captured_queries))
+
+    def test_concurrent_add_not_counted_twice(self):
+        Recipe.favorited_by.through.objects.create(recipe=self.recipe, user=self.user)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorite_count=1)
+
+        # The other request's row appears between this one's delete and insert
+        with patch('django.db.models.query.QuerySet.delete', return_value=(0, {})):
+            self.assertTrue(self.toggle())
+
+        self.assertEqual(self.favorite_count(), 1)
+        self.assertEqual(Recipe.favorited_by.through.objects.filter(recipe=self.recipe).count(), 1)
+
+    def test_stale_instance_save_keeps_count(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        self.toggle()
+        stale.name = 'Very Popular Pie'
+        stale.save()
+
+        self.assertEqual(self.favorite_count(), 1)
+        self.assertEqual(self.recipe.name, 'Very Popular Pie')
+
+class FavoriteStateTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.other = User.objects.create_user(
+            username='otheruser',
+            password='testpass123'
+        )
+        cls.recipes = [
+            Recipe.objects.create(name=f'Cake {i}', ingredients='a, b', cooking_time=30, instructions='Bake', author=cls.user)
+            for i in range(3)
+        ]
+        cls.recipes[0].favorited_by.add(cls.user, cls.other)
+        cls.recipes[1].favorited_by.add(cls.other)
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_with_favorite_state(self):
+        state = {
+            recipe.pk: (recipe.is_favorited, recipe.favorite_count)
+            for recipe in Recipe.objects.with_favorite_state(self.user)
+        }
+        self.assertEqual(state, {
+            self.recipes[0].pk: (True, 2),
+            self.recipes[1].pk: (False, 1),
+            self.recipes[2].pk: (False, 0)
+        })
+
+    def test_anonymous_user_favorites_nothing(self):
+        self.client.logout()
+        response = self.client.get('/')
+        self.assertFalse(any(recipe.is_favorited for recipe in response.context['recipes']))
+        self.assertContains(response, '♥ 2')
+
+    def test_grid_query_count_constant(self):
+        def count_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, 'favorite-heart favorited')
+            return len(queries)
+
+        for url in ('/list/', '/', reverse('recipes:profile')):
+            before = count_queries(url)
+            Recipe.objects.bulk_create([
+                Recipe(name=f'{url} extra {i}', ingredients='a', cooking_time=5, instructions='Mix', author=self.user)
+                for i in range(10)
+            ])
+            with self.subTest(url=url):
+                self.assertEqual(count_queries(url), before)
+
+    def test_detail_page_uses_annotation(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('recipes:detail', kwargs={'pk': self.recipes[0].pk}))
+        self.assertContains(response, 'Favorited')
+        self.assertFalse(any('INNER JOIN "recipes_recipe_favorited_by"' in query['sql'] for query in queries.captured_queries))
+
+    def test_batch_endpoint(self):
+        ids = ','.join(str(recipe.pk) for recipe in self.recipes)
+        # Session, user, cache generations and the favorite state
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('recipes:favorite_state'), {'ids': f'{ids},9999'})
+        self.assertEqual(response.json(), {'favorites': {
+            str(self.recipes[0].pk): {'is_favorited': True, 'favorite_count': 2},
+            str(self.recipes[1].pk): {'is_favorited': False, 'favorite_count': 1},
+            str(self.recipes[2].pk): {'is_favorited': False, 'favorite_count': 0}
+        }})
+
+    def test_batch_endpoint_rejects_bad_ids(self):
+        response = self.client.get(reverse('recipes:favorite_state'), {'ids': '1,two'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('recipes:favorite_state'), {'ids': ','.join(str(i) for i in range(101))})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('recipes:favorite_state'), {'ids': '1,99999999999999999999999'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('recipes:favorite_state'), {'ids': '-1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_endpoint_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('recipes:favorite_state'), {'ids': '1'})
+        self.assertEqual(response.status_code, 302)
+
+# Query plans for every sort and filter, checked against planner statistics for
+# a million recipe table so SQLite plans as it would for a large catalogue
+@override_settings(RECIPES_PAGE_SIZE=2)
+class RecipeCardQueryTest(TestCase):
+    CARD_COLUMNS = ['id', 'name', 'pic', 'cooking_time', 'difficulty', 'difficulty_rank', 'favorite_count', 'version']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Bread {i}', ingredients='flour, water, salt', cooking_time=40 + i,
+                instructions='Knead ' * 1000, author=cls.user
+            )
+            recipe.favorited_by.add(cls.user)
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    # Columns of recipes_recipe selected by each query that fetched a page of cards
+    def get_card_columns(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        selects = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "recipes_recipe"' in query['sql'] and 'LIMIT 3' in query['sql']
+        ]
+        self.assertTrue(selects)
+        return [re.findall(r'"recipes_recipe"\."(\w+)"', sql[:sql.index(' FROM ')]) for sql in selects]
+
+    def test_card_pages_select_only_card_columns(self):
+        urls = ['/', '/profile/'] + [f'/list/?sort={sort}' for sort in ('newest', 'cooking_time', 'difficulty', 'favorites')]
+        for url in urls:
+            for columns in self.get_card_columns(url):
+                with self.subTest(url=url):
+                    self.assertCountEqual(columns, self.CARD_COLUMNS)
+
+    def test_next_page_selects_only_card_columns(self):
+        response = self.client.get('/list/?sort=difficulty')
+        for columns in self.get_card_columns('/list/' + response.context['next_url'], X_Requested_With='XMLHttpRequest'):
+            self.assertCountEqual(columns, self.CARD_COLUMNS)
+
+    def test_cards_do_not_load_deferred_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/list/?sort=difficulty')
+        self.assertFalse(any('"instructions"' in query['sql'] for query in queries.captured_queries))
+
+    def test_for_cards_defers_text_columns(self):
+        recipe = Recipe.objects.for_cards().first()
+        self.assertEqual(recipe.get_deferred_fields(), {'ingredients', 'instructions', 'ingredient_count', 'author_id', 'minhash'})
+
+# The cards backend writes a page of cards without listing the cache directory for each one
+class CardCacheBackendTest(SimpleTestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp(prefix='card-cache-')
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        self.cache = PeriodicCullFileBasedCache(self.location, {'OPTIONS': {'MAX_ENTRIES': 50, 'CULL_EVERY': 25}})
+
+    def test_page_of_cards_does_not_list_directory(self):
+        with patch.object(self.cache, '_list_cache_files', wraps=self.cache._list_cache_files) as list_files:
+            self.cache.set_many({f'card:{i}': 'card' for i in range(24)})
+        self.assertEqual(list_files.call_count, 0)
+        self.assertEqual(len(self.cache.get_many([f'card:{i}' for i in range(24)])), 24)
+
+    def test_culled_every_few_writes(self):
+        for i in range(200):
+            self.cache.set(f'card:{i}', 'card')
+        self.assertLessEqual(len(self.cache._list_cache_files()), 50 + 25)
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'cards': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'card-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+})
+class RecipeCardCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.recipes = [
+            Recipe.objects.create(name=f'Tart {i}', ingredients='pastry, fruit', cooking_time=25, instructions='Bake', author=cls.user)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        caches['cards'].clear()
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_cached_cards_are_not_rendered_again(self):
+        response = self.client.get('/list/')
+        self.assertEqual([template.name for template in response.templates].count('recipes/_recipe_card.html'), 3)
+
+        response = self.client.get('/list/')
+        self.assertTemplateNotUsed(response, 'recipes/_recipe_card.html')
+        self.assertContains(response, 'Tart 2')
+
+    def test_page_reads_cache_once(self):
+        self.client.get('/list/')
+        with patch.object(caches['cards'], 'get_many', wraps=caches['cards'].get_many) as get_many:
+            self.client.get('/list/')
+        self.assertEqual(get_many.call_count, 1)
+
+    def test_only_misses_are_rendered(self):
+        self.client.get('/list/')
+        self.recipes[1].name = 'Lemon Tart'
+        self.recipes[1].save()
+
+        response = self.client.get('/list/')
+        self.assertEqual([template.name for template in response.templates].count('recipes/_recipe_card.html'), 1)
+        self.assertContains(response, 'Lemon Tart')
+        self.assertNotContains(response, 'Tart 1')
+
+    def test_save_changes_version(self):
+        version = self.recipes[0].version
+        self.recipes[0].save(update_fields=['name'])
+        self.assertNotEqual(Recipe.objects.get(pk=self.recipes[0].pk).version, version)
+
+    def test_favoriting_updates_card(self):
+        self.client.get('/list/')
+        self.client.post(reverse('recipes:favorite', kwargs={'pk': self.recipes[0].pk}))
+
+        response = self.client.get('/list/')
+        self.assertContains(response, 'favorite-heart favorited', count=1)
+        self.assertContains(response, '♥ 1')
+
+    def test_home_cards_vary_by_login(self):
+        self.client.get('/')
+        self.client.logout()
+        response = self.client.get('/')
+        self.assertContains(response, 'class="recipe-card locked"', count=3)
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'cards': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'card-tests'},
+    'pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'page-tests'}
+})
+class AnonymousPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.recipe = Recipe.objects.create(name='Cached Curry', ingredients='rice, curry paste', cooking_time=30, instructions='Simmer', author=cls.user)
+
+    def setUp(self):
+        caches['pages'].clear()
+        caches['cards'].clear()
+
+    def test_repeat_visit_is_served_from_cache(self):
+        response = self.client.get('/')
+        self.assertTemplateUsed(response, 'recipes/home.html')
+
+        response = self.client.get('/')
+        self.assertEqual(response.templates, [])
+        self.assertContains(response, 'Cached Curry')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.get('/')
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get('/')
+        self.assertTemplateUsed(response, 'recipes/home.html')
+        self.assertContains(response, 'Hello testuser!')
+        self.assertNotIn('ETag', response)
+
+    def test_conditional_requests_get_304(self):
+        response = self.client.get('/')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+
+        response = self.client.get('/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_fragment_and_page_are_cached_separately(self):
+        self.client.get('/')
+        response = self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateUsed(response, 'recipes/_recipe_page.html')
+        self.assertNotContains(response, '<nav>')
+
+    def test_save_invalidates(self):
+        etag = self.client.get('/')['ETag']
+        self.recipe.name = 'Fresh Curry'
+        self.recipe.save()
+
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Fresh Curry')
+
+    def test_delete_invalidates(self):
+        self.client.get('/')
+        Recipe.objects.get(pk=self.recipe.pk).delete()
+        self.assertNotContains(self.client.get('/'), 'Cached Curry')
+
+    def test_favorite_invalidates(self):
+        self.assertContains(self.client.get('/'), '♥ 0')
+        client = Client()
+        client.login(username='testuser', password='testpass123')
+        client.post(reverse('recipes:favorite', kwargs={'pk': self.recipe.pk}))
+        self.assertContains(self.client.get('/'), '♥ 1')
+
+class CacheGenerationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.recipe = Recipe.objects.create(name='Gen Soup', ingredients='leek, potato', cooking_time=40, instructions='Blend', author=cls.user)
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+        check_generations()
+
+    def get_value(self, name):
+        return CacheGeneration.objects.get(name=name).value
+
+    # What another worker's bump looks like to this one: the table moves on its own
+    def bump_elsewhere(self, name):
+        CacheGeneration.objects.filter(name=name).update(value=F('value') + 1, updated=timezone.now())
+
+    def test_recipe_save_and_delete_bump_recipes(self):
+        value = self.get_value(CacheGeneration.RECIPES)
+        self.recipe.save()
+        self.assertNotEqual(self.get_value(CacheGeneration.RECIPES), value)
+
+        value = self.get_value(CacheGeneration.RECIPES)
+        Recipe.objects.get(pk=self.recipe.pk).delete()
+        self.assertNotEqual(self.get_value(CacheGeneration.RECIPES), value)
+
+    def test_favorites_bump_favorites(self):
+        recipes_value = self.get_value(CacheGeneration.RECIPES)
+        value = self.get_value(CacheGeneration.FAVORITES)
+        self.client.post(reverse('recipes:favorite', kwargs={'pk': self.recipe.pk}))
+        self.assertNotEqual(self.get_value(CacheGeneration.FAVORITES), value)
+
+        value = self.get_value(CacheGeneration.FAVORITES)
+        self.recipe.favorited_by.clear()
+        self.assertNotEqual(self.get_value(CacheGeneration.FAVORITES), value)
+        self.assertEqual(self.get_value(CacheGeneration.RECIPES), recipes_value)
+
+    def test_change_in_another_worker_drops_local_caches(self):
+        ingredient_index.build()
+        chart_cache.set('key', b'chart')
+
+        self.bump_elsewhere(CacheGeneration.RECIPES)
+        self.client.get('/')
+        self.assertFalse(ingredient_index._built)
+        # Charts are keyed by what they plot, so a recipe change can't make one stale
+        self.assertEqual(chart_cache.get('key'), b'chart')
+
+    def test_own_change_keeps_local_caches(self):
+        ingredient_index.build()
+        self.recipe.ingredients = 'leek, potato, cream'
+        self.recipe.save()
+
+        self.client.get('/')
+        self.assertTrue(ingredient_index._built)
+        self.assertEqual(ingredient_index.search('cream'), [self.recipe.pk])
+
+    def test_missed_change_is_not_hidden_by_own_change(self):
+        ingredient_index.build()
+        self.bump_elsewhere(CacheGeneration.RECIPES)
+        self.recipe.save()
+
+        self.client.get('/')
+        self.assertFalse(ingredient_index._built)
+
+    def test_favorites_do_not_drop_ingredient_index(self):
+        ingredient_index.build()
+        self.bump_elsewhere(CacheGeneration.FAVORITES)
+        self.client.get('/')
+        self.assertTrue(ingredient_index._built)
+
+    def test_one_generation_query_per_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/')
+        table = CacheGeneration._meta.db_table
+        self.assertEqual(sum(table in query['sql'] for query in queries.captured_queries), 1)
+
+@override_settings(TRENDING_DAYS=7, LEADERBOARD_SIZE=10)
+class LeaderboardTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(username=f'user{i}', password='testpass123')
+            for i in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(name=f'Stew {i}', ingredients='a, b', cooking_time=30, instructions='Cook', author=cls.users[0])
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.login(username='user0', password='testpass123')
+
+    def trend(self, recipe):
+        return RecipeTrend.objects.filter(recipe=recipe).values_list('recent_favorites', flat=True).first()
+
+    def test_toggle_records_events(self):
+        url = reverse('recipes:favorite', kwargs={'pk': self.recipes[0].pk})
+        self.client.post(url)
+        self.assertEqual(self.trend(self.recipes[0]), 1)
+
+        self.client.post(url)
+        self.assertEqual(self.trend(self.recipes[0]), 0)
+        self.assertEqual(
+            list(FavoriteEvent.objects.filter(recipe=self.recipes[0]).order_by('pk').values_list('delta', flat=True)),
+            [1, -1]
+        )
+
+    def test_m2m_changes_record_events(self):
+        self.recipes[0].favorited_by.add(*self.users)
+        self.users[0].favorite_recipes.add(self.recipes[1])
+        self.assertEqual(self.trend(self.recipes[0]), 3)
+        self.assertEqual(self.trend(self.recipes[1]), 1)
+
+        # Removing a favorite that doesn't exist changes nothing
+        self.recipes[1].favorited_by.remove(self.users[2])
+        self.assertEqual(self.trend(self.recipes[1]), 1)
+
+        self.recipes[0].favorited_by.clear()
+        self.users[0].favorite_recipes.clear()
+        self.assertEqual(self.trend(self.recipes[0]), 0)
+        self.assertEqual(self.trend(self.recipes[1]), 0)
+
+    def test_trending_ranks_by_recent_favorites(self):
+        self.recipes[1].favorited_by.add(*self.users)
+        self.recipes[2].favorited_by.add(self.users[0])
+
+        trending = get_trending()
+        self.assertEqual([recipe.pk for recipe in trending], [self.recipes[1].pk, self.recipes[2].pk])
+        self.assertEqual(trending[0].recent_favorites, 3)
+
+    def test_old_favorites_leave_trending(self):
+        self.recipes[0].favorited_by.add(*self.users)
+        self.recipes[1].favorited_by.add(self.users[0])
+        FavoriteEvent.objects.filter(recipe=self.recipes[0]).update(created=timezone.now() - timedelta(days=8))
+        FavoriteEvent.objects.create(recipe=self.recipes[0], user=self.users[1], delta=-1)
+
+        self.assertEqual(expire_favorite_events(), 1)
+        self.assertEqual(self.trend(self.recipes[0]), -1)
+        self.assertEqual(list(FavoriteEvent.objects.filter(recipe=self.recipes[0]).values_list('delta', flat=True)), [-1])
+        self.assertEqual([recipe.pk for recipe in get_trending()], [self.recipes[1].pk])
+
+        # Running it again doesn't take the same events off twice
+        self.assertEqual(expire_favorite_events(), 0)
+        self.assertEqual(self.trend(self.recipes[0]), -1)
+
+        # All time favorites are unaffected
+        self.assertEqual([recipe.pk for recipe in get_most_favorited()], [self.recipes[0].pk, self.recipes[1].pk])
+
+    def test_old_favorites_are_deleted_in_batches(self):
+        self.recipes[0].favorited_by.add(*self.users)
+        self.recipes[1].favorited_by.add(self.users[0])
+        FavoriteEvent.objects.update(created=timezone.now() - timedelta(days=8))
+
+        expire_favorite_events(batch_size=2)
+        self.assertEqual(FavoriteEvent.objects.count(), 2)
+        expire_favorite_events(batch_size=2)
+        self.assertFalse(FavoriteEvent.objects.exists())
+        self.assertEqual(self.trend(self.recipes[0]), 0)
+        self.assertEqual(self.trend(self.recipes[1]), 0)
+
+    def test_leaderboard_page(self):
+        self.recipes[2].favorited_by.add(self.users[1])
+        response = self.client.get(reverse('recipes:leaderboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'recipes/leaderboard.html')
+        self.assertContains(response, 'Stew 2')
+        self.assertNotContains(response, 'Stew 1')
+
+    def test_leaderboard_json(self):
+        self.recipes[0].favorited_by.add(self.users[1], self.users[2])
+        self.recipes[2].favorited_by.add(self.users[1])
+        FavoriteEvent.objects.filter(recipe=self.recipes[0]).update(created=timezone.now() - timedelta(days=8))
+
+        data = self.client.get(reverse('recipes:leaderboard'), {'format': 'json'}).json()
+        self.assertEqual(
+            [(entry['id'], entry['favorite_count']) for entry in data['most_favorited']],
+            [(self.recipes[0].pk, 2), (self.recipes[2].pk, 1)]
+        )
+        self.assertEqual(
+            [(entry['id'], entry['recent_favorites']) for entry in data['trending']],
+            [(self.recipes[2].pk, 1)]
+        )
+
+    def test_leaderboard_does_not_count_favorites(self):
+        for recipe in self.recipes:
+            recipe.favorited_by.add(*self.users)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('recipes:leaderboard'))
+        through = Recipe.favorited_by.through._meta.db_table
+        self.assertFalse(any(through in query['sql'] for query in queries.captured_queries))
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+@override_settings(RECIPES_PAGE_SIZE=1)
+class RecipeListQueryPlanTest(TestCase):
+    STATS = {
+        None: '1000000',
+        'recipe_cooking_time_idx': '1000000 1000 1',
+        'recipe_difficulty_time_idx': '1000000 250000 250 1',
+        'recipe_difficulty_id_idx': '1000000 250000 1',
+        'recipe_favorites_idx': '1000000 10000 1',
+        'recipe_difficulty_favs_idx': '1000000 250000 2500 1'
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        for i in range(3):
+            Recipe.objects.create(name=f'Soup {i}', ingredients='a, b, c, d', cooking_time=5 + i, instructions='Boil')
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'recipes_recipe'")
+            cursor.execute("SELECT name FROM pragma_index_list('recipes_recipe')")
+            for index in [None] + [row[0] for row in cursor.fetchall()]:
+                cursor.execute(
+                    'INSERT INTO sqlite_stat1 VALUES (%s, %s, %s)',
+                    ['recipes_recipe', index, self.STATS.get(index, '1000000 1000')]
+                )
+            cursor.execute('ANALYZE sqlite_schema')
+
+    def get_plan(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        sql = next(
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "recipes_recipe"' in query['sql'] and 'LIMIT' in query['sql']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return response, ' / '.join(row[-1] for row in cursor.fetchall())
+
+    def test_no_sort_needs_a_temp_btree_or_table_scan(self):
+        for sort in ('newest', 'cooking_time', 'difficulty', 'favorites'):
+            for filters in ({}, {'difficulty': 'Medium'}, {'max_cooking_time': 30}, {'difficulty': 'Medium', 'max_cooking_time': 30}):
+                url = '/list/?' + '&'.join(f'{key}={value}' for key, value in dict(filters, sort=sort).items())
+                response, plan = self.get_plan(url)
+                pages = [plan]
+
+                _, plan = self.get_plan('/list/' + response.context['next_url'])
+                pages.append(plan)
+
+                for plan in pages:
+                    with self.subTest(sort=sort, filters=filters, plan=plan):
+                        self.assertNotIn('TEMP B-TREE', plan)
+                        # Newest reads the table itself in primary key order
+                        if sort != 'newest':
+                            self.assertRegex(plan, r'^(SCAN|SEARCH) recipes_recipe USING INDEX recipe_')
+
 # Detail View Tests 
 class RecipeDetailViewTest(TestCase):
 
@@ -430,6 +1340,7 @@ class SearchViewAuthTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertIn('/login', response.url)
 
+@override_settings(CHART_RENDER_WORKERS=0)
 class SearchViewTest(TestCase):
     
     @classmethod
@@ -572,6 +1483,837 @@ class SearchViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIsNone(response.context['chart'])
 
+@override_settings(CHART_RENDER_WORKERS=0)
+class FullTextSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.garlic_bread = Recipe.objects.create(
+            name='Garlic Bread',
+            ingredients='bread, garlic, butter',
+            cooking_time=10,
+            instructions='Spread butter on bread and bake'
+        )
+        cls.pasta = Recipe.objects.create(
+            name='Aglio e Olio',
+            ingredients='spaghetti, olive oil, chili',
+            cooking_time=15,
+            instructions='Fry sliced garlic in the oil and toss with pasta'
+        )
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def search(self, **data):
+        response = self.client.post('/search/', dict(data, chart_type='#1'))
+        return response.context['recipes_df'] or ''
+
+    def test_keywords_search_instructions(self):
+        results = self.search(keywords='sliced')
+        self.assertIn('Aglio e Olio', results)
+        self.assertNotIn('Garlic Bread', results)
+
+    def test_keywords_ranked_by_relevance(self):
+        results = self.search(keywords='garlic')
+        self.assertLess(results.index('Garlic Bread'), results.index('Aglio e Olio'))
+
+    # A rank looked up per row reruns the MATCH for every match, so ranking n matches
+    # costs n MATCHes; the plan must run each MATCH once, outside any correlated subquery
+    @skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+    def test_ranking_runs_match_once(self):
+        backend = get_search_backend()
+        qs = backend.rank(backend.filter(Recipe.objects.all(), name='garlic'), name='garlic')
+        sql, params = qs.values_list('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        self.assertFalse([step for step in plan if 'CORRELATED' in step], plan)
+        self.assertEqual(list(qs), [self.garlic_bread])
+
+    def test_name_matches_word_prefixes(self):
+        self.assertIn('Garlic Bread', self.search(recipe_name='garl'))
+        self.assertNotIn('Garlic Bread', self.search(recipe_name='arlic'))
+
+    def test_name_search_only_matches_name(self):
+        self.assertNotIn('Aglio e Olio', self.search(recipe_name='garlic'))
+
+    def test_punctuation_only_query_does_not_filter(self):
+        results = self.search(recipe_name='!!!')
+        self.assertIn('Garlic Bread', results)
+        self.assertIn('Aglio e Olio', results)
+
+    def test_index_updated_on_save(self):
+        self.pasta.name = 'Pasta Aglio'
+        self.pasta.save()
+        self.assertIn('Pasta Aglio', self.search(recipe_name='pasta'))
+
+    def test_index_updated_on_delete(self):
+        pk = self.garlic_bread.pk
+        self.garlic_bread.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_rebuild_command_indexes_bulk_created_recipes(self):
+        Recipe.objects.bulk_create([
+            Recipe(name='Lemonade', ingredients='lemon, sugar, water', cooking_time=5, instructions='Stir')
+        ])
+        self.assertNotIn('Lemonade', self.search(recipe_name='lemonade'))
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 recipes', out.getvalue())
+        self.assertIn('Lemonade', self.search(recipe_name='lemonade'))
+
+class IngredientIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.shortbread = Recipe.objects.create(
+            name='Shortbread',
+            ingredients='flour, Unsalted  Butter, sugar',
+            cooking_time=30,
+            instructions='Rub together and bake'
+        )
+        cls.chips = Recipe.objects.create(
+            name='Chips',
+            ingredients='potatoes, salt, oil, Salt',
+            cooking_time=25,
+            instructions='Fry twice'
+        )
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def search(self, ingredient):
+        response = self.client.post('/search/', {'ingredient': ingredient, 'chart_type': '#1'})
+        return response.context['recipes_df'] or ''
+
+    def test_ingredients_normalised_on_save(self):
+        names = list(self.shortbread.ingredient_items.order_by('recipe_ingredients__position').values_list('name', flat=True))
+        self.assertEqual(names, ['flour', 'unsalted butter', 'sugar'])
+
+    def test_duplicate_ingredients_stored_once(self):
+        self.assertEqual(self.chips.recipe_ingredients.count(), 3)
+        self.assertEqual(Ingredient.objects.filter(name='salt').count(), 1)
+
+    def test_ingredients_resynced_on_change(self):
+        self.chips.ingredients = 'potatoes, vinegar'
+        self.chips.save()
+        names = set(self.chips.ingredient_items.values_list('name', flat=True))
+        self.assertEqual(names, {'potatoes', 'vinegar'})
+
+    def test_matching_is_a_name_prefix(self):
+        names = set(Ingredient.objects.matching(' SALT').values_list('name', flat=True))
+        self.assertEqual(names, {'salt'})
+        self.assertFalse(Ingredient.objects.matching('   ').exists())
+
+    def test_salt_does_not_match_unsalted_butter(self):
+        results = self.search('salt')
+        self.assertIn('Chips', results)
+        self.assertNotIn('Shortbread', results)
+
+    def test_prefix_matches_plural(self):
+        self.assertIn('Chips', self.search('potato'))
+
+    def test_multi_word_ingredient(self):
+        results = self.search('unsalted butter')
+        self.assertIn('Shortbread', results)
+        self.assertNotIn('Chips', results)
+
+class IngredientQueryParserTest(TestCase):
+
+    def test_and_not(self):
+        self.assertEqual(
+            parse_ingredient_query('Chicken AND garlic NOT dairy'),
+            [(['chicken', 'garlic'], ['dairy'])]
+        )
+
+    def test_or_splits_groups(self):
+        self.assertEqual(
+            parse_ingredient_query('chicken, olive  oil OR tofu NOT soy sauce'),
+            [(['chicken', 'olive oil'], []), (['tofu'], ['soy sauce'])]
+        )
+
+    def test_leading_not(self):
+        self.assertEqual(parse_ingredient_query('NOT nuts'), [([], ['nuts'])])
+
+    def test_empty_query(self):
+        self.assertEqual(parse_ingredient_query('   '), [])
+
+    def test_malformed_queries(self):
+        for query in ('AND chicken', 'chicken OR', 'chicken NOT NOT dairy', 'chicken AND OR tofu'):
+            with self.assertRaises(ValueError):
+                parse_ingredient_query(query)
+
+class IngredientBitmapIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.curry = Recipe.objects.create(
+            name='Chicken Curry',
+            ingredients='chicken, garlic, onion, cream',
+            cooking_time=40,
+            instructions='Simmer'
+        )
+        cls.roast = Recipe.objects.create(
+            name='Roast Chicken',
+            ingredients='chicken, garlic, lemon',
+            cooking_time=90,
+            instructions='Roast'
+        )
+        cls.stir_fry = Recipe.objects.create(
+            name='Tofu Stir Fry',
+            ingredients='tofu, garlic, soy sauce',
+            cooking_time=15,
+            instructions='Stir fry'
+        )
+
+    def setUp(self):
+        ingredient_index.clear()
+        self.client.login(username='testuser', password='testpass123')
+
+    def names(self, query):
+        return set(Recipe.objects.filter(pk__in=ingredient_index.search(query)).values_list('name', flat=True))
+
+    def test_and_not_query(self):
+        self.assertEqual(self.names('chicken AND garlic NOT cream'), {'Roast Chicken'})
+
+    def test_or_query(self):
+        self.assertEqual(self.names('lemon OR tofu'), {'Roast Chicken', 'Tofu Stir Fry'})
+
+    def test_not_only_query(self):
+        self.assertEqual(self.names('NOT chicken'), {'Tofu Stir Fry'})
+
+    def test_terms_match_ingredient_prefixes(self):
+        self.assertEqual(self.names('soy'), {'Tofu Stir Fry'})
+        self.assertEqual(self.names('sauce'), set())
+
+    def test_updated_on_save(self):
+        self.assertEqual(len(ingredient_index), 0)
+        self.names('garlic')
+        self.assertEqual(len(ingredient_index), 3)
+
+        self.roast.ingredients = 'chicken, rosemary'
+        self.roast.save()
+        self.assertEqual(self.names('rosemary'), {'Roast Chicken'})
+        self.assertNotIn('Roast Chicken', self.names('garlic'))
+
+        Recipe.objects.create(name='Garlic Soup', ingredients='garlic, stock', cooking_time=30, instructions='Boil')
+        self.assertEqual(self.names('garlic NOT chicken'), {'Tofu Stir Fry', 'Garlic Soup'})
+
+    def test_updated_on_delete(self):
+        self.names('garlic')
+        self.stir_fry.delete()
+        self.assertEqual(len(ingredient_index), 2)
+        self.assertEqual(self.names('tofu'), set())
+
+        # The freed slot is reused for the next recipe
+        Recipe.objects.create(name='Garlic Soup', ingredients='garlic, stock', cooking_time=30, instructions='Boil')
+        self.assertEqual(self.names('stock'), {'Garlic Soup'})
+
+    def test_search_view(self):
+        response = self.client.post('/search/', {'ingredient_query': 'garlic NOT chicken', 'chart_type': '#1'})
+        self.assertContains(response, 'Tofu Stir Fry')
+        self.assertNotContains(response, 'Roast Chicken')
+
+    def test_search_view_combines_with_other_filters(self):
+        response = self.client.post('/search/', {
+            'ingredient_query': 'chicken',
+            'max_cooking_time': 60,
+            'chart_type': '#1'
+        })
+        self.assertContains(response, 'Chicken Curry')
+        self.assertNotContains(response, 'Roast Chicken')
+
+    def test_search_view_shows_query_errors(self):
+        response = self.client.post('/search/', {'ingredient_query': 'NOT', 'chart_type': '#1'})
+        self.assertContains(response, 'Expected an ingredient after NOT')
+
+    def test_large_result_set_filter(self):
+        Recipe.objects.bulk_create([
+            Recipe(name=f'Stock {i}', ingredients='water, bones', cooking_time=60, instructions='Simmer')
+            for i in range(40000)
+        ])
+        ingredient_index.build()
+        qs = get_search_backend().filter_pks(Recipe.objects.all(), ingredient_index.search('water'))
+        self.assertEqual(qs.count(), 40000)
+
+# Multi-ingredient queries against a 50,000 recipe index, without touching the database
+@tag('slow')
+class IngredientBitmapIndexSpeedTest(TestCase):
+
+    def setUp(self):
+        self.index = IngredientIndex()
+        self.index._built = True
+        pantry = [f'ingredient {i}' for i in range(500)]
+        for pk in range(50000):
+            ingredients = ', '.join(pantry[(pk * step) % 500] for step in (1, 7, 31, 97, 211))
+            self.index._add(pk, ingredients)
+
+    def test_multi_ingredient_query_is_sub_millisecond(self):
+        groups = parse_ingredient_query('ingredient 1 AND ingredient 7 NOT ingredient 31 OR ingredient 2 AND ingredient 14')
+        timings = []
+        for _ in range(200):
+            start = time.perf_counter()
+            self.index.count(groups)
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        self.assertLess(timings[len(timings) // 2], 0.001)
+
+class PantryViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.omelette = Recipe.objects.create(
+            name='Omelette',
+            ingredients='eggs, butter, salt',
+            cooking_time=5,
+            instructions='Whisk and fry'
+        )
+        cls.pancakes = Recipe.objects.create(
+            name='Pancakes',
+            ingredients='eggs, flour, milk, butter',
+            cooking_time=20,
+            instructions='Mix and fry'
+        )
+        cls.salad = Recipe.objects.create(
+            name='Salad',
+            ingredients='lettuce, tomatoes',
+            cooking_time=5,
+            instructions='Toss'
+        )
+
+    def setUp(self):
+        ingredient_index.clear()
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_ranked_by_coverage(self):
+        matches = ingredient_index.cover(['Eggs', 'butter', 'milk'])
+        self.assertEqual(matches, [
+            (self.pancakes.pk, 0.75, ['flour']),
+            (self.omelette.pk, 2 / 3, ['salt'])
+        ])
+
+    def test_ties_broken_by_fewest_missing(self):
+        matches = ingredient_index.cover(['eggs', 'butter', 'flour', 'salt'])
+        self.assertEqual([pk for pk, coverage, missing in matches], [self.omelette.pk, self.pancakes.pk])
+        self.assertEqual(matches[0][1], 1.0)
+
+    def test_pantry_items_match_plurals_not_prefixes(self):
+        self.assertEqual(ingredient_index.cover(['tomato', 'lettuces']), [(self.salad.pk, 1.0, [])])
+        ratatouille = Recipe.objects.create(name='Ratatouille', ingredients='eggplant, zucchini', cooking_time=60, instructions='Stew')
+        self.assertEqual(ingredient_index.cover(['egg', 'zucchini'])[0], (ratatouille.pk, 0.5, ['eggplant']))
+        self.assertEqual(ingredient_index.cover(['egg']), [
+            (self.omelette.pk, 1 / 3, ['butter', 'salt']),
+            (self.pancakes.pk, 0.25, ['butter', 'flour', 'milk'])
+        ])
+
+    def test_limit(self):
+        self.assertEqual(len(ingredient_index.cover(['eggs'], limit=1)), 1)
+
+    def test_no_matches(self):
+        self.assertEqual(ingredient_index.cover(['caviar']), [])
+        self.assertEqual(ingredient_index.cover([' ', '']), [])
+
+    def test_view_lists_coverage_and_missing(self):
+        response = self.client.get(reverse('recipes:pantry'), {'ingredients': 'eggs, butter, milk'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Pancakes')
+        self.assertContains(response, '75%')
+        self.assertContains(response, 'flour')
+        self.assertNotContains(response, 'Salad')
+
+    def test_view_no_matches(self):
+        response = self.client.get(reverse('recipes:pantry'), {'ingredients': 'caviar'})
+        self.assertContains(response, 'No recipe uses any of those ingredients')
+
+    def test_view_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('recipes:pantry'))
+        self.assertEqual(response.status_code, 302)
+
+# Pantry lookups against a 100,000 recipe index, without touching the database
+@tag('slow')
+class PantryBenchmarkTest(TestCase):
+
+    def setUp(self):
+        self.index = IngredientIndex()
+        self.index._built = True
+        rng = random.Random(0)
+        pantry = [f'item{i:04d}' for i in range(2000)]
+        for pk in range(100000):
+            # Half the recipes draw from a small set of common ingredients
+            self.index._add(pk, ', '.join(rng.sample(pantry[:300] if pk % 2 else pantry, 8)))
+
+    def test_p95_latency(self):
+        pantry = [f'item{i:04d}' for i in range(0, 300, 20)]
+        timings = []
+        for _ in range(50):
+            start = time.perf_counter()
+            matches = self.index.cover(pantry)
+            timings.append(time.perf_counter() - start)
+
+        self.assertEqual(len(matches), 20)
+        timings.sort()
+        self.assertLess(timings[int(len(timings) * 0.95) - 1], 0.05)
+
+class SimilarRecipesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.pancakes = Recipe.objects.create(
+            name='Pancakes',
+            ingredients='eggs, flour, milk, butter, sugar',
+            cooking_time=20,
+            instructions='Mix and fry'
+        )
+        cls.crepes = Recipe.objects.create(
+            name='Crepes',
+            ingredients='Eggs, flour, milk, butter, sugar',
+            cooking_time=15,
+            instructions='Mix and fry thinly'
+        )
+        cls.salad = Recipe.objects.create(
+            name='Salad',
+            ingredients='lettuce, tomatoes, cucumber',
+            cooking_time=5,
+            instructions='Toss'
+        )
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_signature_computed_on_save(self):
+        self.assertIsNotNone(self.pancakes.minhash)
+        self.assertEqual(self.pancakes.buckets.count(), BANDS)
+
+    def test_signature_updated_when_ingredients_change(self):
+        signature = bytes(self.salad.minhash)
+        self.salad.ingredients = 'lettuce, croutons, parmesan'
+        self.salad.save(update_fields=['ingredients'])
+        self.salad.refresh_from_db()
+        self.assertNotEqual(bytes(self.salad.minhash), signature)
+
+    def test_signature_kept_when_ingredients_unchanged(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.salad.save(update_fields=['name'])
+        self.assertFalse(any('recipes_recipebucket' in query['sql'] for query in queries.captured_queries))
+
+    def test_estimate_close_to_jaccard(self):
+        first = get_signature([f'item {i}' for i in range(30)])
+        second = get_signature([f'item {i}' for i in range(15, 45)])
+        self.assertAlmostEqual(estimate_similarity(first, second), 1 / 3, delta=0.15)
+
+    def test_identical_ingredients_are_most_similar(self):
+        similar = self.pancakes.get_similar_recipes()
+        self.assertEqual(similar, [self.crepes])
+        self.assertEqual(similar[0].similarity, 1.0)
+
+    def test_unrelated_recipes_excluded(self):
+        self.assertEqual(self.salad.get_similar_recipes(), [])
+
+    def test_lookup_query_count_independent_of_catalogue(self):
+        Recipe.objects.bulk_create([
+            Recipe(name=f'Toast {i}', ingredients=f'bread, butter, topping {i}', cooking_time=5, instructions='Toast')
+            for i in range(200)
+        ])
+        call_command('backfill_minhash', workers=0, stdout=StringIO())
+        with self.assertNumQueries(2):
+            self.pancakes.get_similar_recipes()
+
+    # Each of these shares eggs and flour with the pancakes (0.25 similarity); with
+    # two rows per band they matched over three bucket rows each
+    def test_lookup_scans_few_rows_for_loosely_similar_catalogue(self):
+        matched = self.pancakes.get_bucket_matches().count()
+        Recipe.objects.bulk_create([
+            Recipe(name=f'Bake {i}', ingredients=f'eggs, flour, filling {i}, topping {i}, glaze {i}', cooking_time=30, instructions='Bake')
+            for i in range(500)
+        ])
+        call_command('backfill_minhash', workers=0, stdout=StringIO())
+        self.assertLess(self.pancakes.get_bucket_matches().count() - matched, 50)
+
+    def test_detail_page_shows_similar_recipes(self):
+        response = self.client.get(reverse('recipes:detail', kwargs={'pk': self.pancakes.pk}))
+        self.assertContains(response, 'Similar Recipes')
+        self.assertContains(response, 'Crepes')
+        self.assertNotContains(response, 'Salad')
+
+    def test_backfill_command(self):
+        Recipe.objects.bulk_create([
+            Recipe(name='Drop Scones', ingredients='eggs, flour, milk, butter, sugar', cooking_time=10, instructions='Fry')
+        ])
+        scones = Recipe.objects.get(name='Drop Scones')
+        self.assertIsNone(scones.minhash)
+
+        out = StringIO()
+        call_command('backfill_minhash', workers=1, batch_size=2, stdout=out)
+        self.assertIn('Computed signatures for 4 recipes', out.getvalue())
+
+        scones.refresh_from_db()
+        self.assertEqual(scones.buckets.count(), BANDS)
+        self.assertIn(scones, self.pancakes.get_similar_recipes())
+        self.assertEqual(RecipeBucket.objects.count(), BANDS * 4)
+
+# The search view should read matching recipes with one projected query
+@override_settings(CHART_RENDER_WORKERS=0)
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search-tests'}
+})
+class SearchCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.curry = Recipe.objects.create(name='Chicken Curry', ingredients='chicken, garlic, rice', cooking_time=25, instructions='Simmer')
+        cls.salad = Recipe.objects.create(name='Chicken Salad', ingredients='chicken, lettuce', cooking_time=5, instructions='Toss')
+        cls.soup = Recipe.objects.create(name='Tomato Soup', ingredients='tomato, garlic', cooking_time=20, instructions='Blend')
+
+    def setUp(self):
+        caches['search'].clear()
+        self.client.login(username='testuser', password='testpass123')
+
+    def normalize(self, data):
+        form = RecipesSearchForm(data=dict({'chart_type': '#1'}, **data))
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.get_normalized_data()
+
+    def search(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/search/', dict({'chart_type': '#1'}, **data))
+        recipe_selects = [query for query in queries.captured_queries if 'FROM "recipes_recipe"' in query['sql']]
+        return response, recipe_selects
+
+    def test_equivalent_queries_normalize_alike(self):
+        self.assertEqual(self.normalize({'recipe_name': '  Chicken   CURRY '}), self.normalize({'recipe_name': 'chicken curry'}))
+        self.assertEqual(self.normalize({'ingredient': ' Garlic'}), self.normalize({'ingredient': 'garlic'}))
+        self.assertEqual(
+            self.normalize({'ingredient_query': 'Garlic AND chicken OR tomato'}),
+            self.normalize({'ingredient_query': 'tomato OR chicken, garlic, garlic'})
+        )
+        self.assertNotEqual(self.normalize({'difficulty': 'Easy'}), self.normalize({'difficulty': 'Hard'}))
+        self.assertNotEqual(self.normalize({'ingredient_query': 'chicken NOT garlic'}), self.normalize({'ingredient_query': 'garlic NOT chicken'}))
+
+    def test_repeat_search_is_served_from_cache(self):
+        response, recipe_selects = self.search({'keywords': 'chicken'})
+        self.assertTrue(recipe_selects)
+
+        response, recipe_selects = self.search({'keywords': ' CHICKEN '})
+        self.assertEqual(recipe_selects, [])
+        self.assertContains(response, 'Chicken Curry')
+        self.assertContains(response, 'Chicken Salad')
+        self.assertNotContains(response, 'Tomato Soup')
+
+    def test_cached_entry_holds_ids_and_table(self):
+        with patch.object(caches['search'], 'set', wraps=caches['search'].set) as cache_set:
+            self.search({'difficulty': 'Easy', 'max_cooking_time': 30})
+        entries = [call.args[1] for call in cache_set.call_args_list]
+        self.assertEqual(len(entries), 1)
+        self.assertCountEqual(entries[0]['pks'], [recipe.pk for recipe in Recipe.objects.filter(difficulty='Easy')])
+        self.assertIn('results-table', entries[0]['table'])
+
+    def test_recipe_change_invalidates(self):
+        self.search({'keywords': 'chicken'})
+        self.soup.name = 'Chicken Tomato Soup'
+        self.soup.save()
+
+        response, recipe_selects = self.search({'keywords': 'chicken'})
+        self.assertTrue(recipe_selects)
+        self.assertContains(response, 'Chicken Tomato Soup')
+
+    def test_favorites_do_not_invalidate(self):
+        self.search({'keywords': 'chicken'})
+        self.curry.favorited_by.add(self.user)
+        response, recipe_selects = self.search({'keywords': 'chicken'})
+        self.assertEqual(recipe_selects, [])
+
+    def test_chart_type_is_part_of_key(self):
+        self.search({'keywords': 'chicken'})
+        response, recipe_selects = self.search({'keywords': 'chicken', 'chart_type': '#3', 'chart_format': 'svg'})
+        self.assertTrue(recipe_selects)
+        self.assertIsNotNone(response.context['chart'])
+
+    @override_settings(SEARCH_CACHE_TIMEOUT=0)
+    def test_results_expire(self):
+        self.search({'keywords': 'chicken'})
+        response, recipe_selects = self.search({'keywords': 'chicken'})
+        self.assertTrue(recipe_selects)
+
+@override_settings(CHART_RENDER_WORKERS=0)
+class SearchProjectionTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        Recipe.objects.bulk_create([
+            Recipe(
+                name=f'Recipe {i}',
+                ingredients='a, b, c',
+                ingredient_count=3,
+                cooking_time=i % 60 + 1,
+                difficulty='Easy',
+                instructions='Long instructions. ' * 50
+            )
+            for i in range(50000)
+        ], batch_size=5000)
+        get_search_backend().rebuild()
+
+    def setUp(self):
+        self.client.login(username='testuser', password='testpass123')
+        self.instances = 0
+        post_init.connect(self.count_instance, sender=Recipe)
+        self.addCleanup(post_init.disconnect, self.count_instance, sender=Recipe)
+
+    def count_instance(self, **kwargs):
+        self.instances += 1
+
+    def search(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/search/', data)
+        recipe_selects = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and '"recipes_recipe"' in query['sql']
+        ]
+        return response, recipe_selects
+
+    def test_one_select_and_no_instances_for_50k_rows(self):
+        response, recipe_selects = self.search({'difficulty': 'Easy', 'chart_type': '#1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Recipe 49999')
+        self.assertEqual(len(recipe_selects), 1)
+        self.assertEqual(self.instances, 0)
+
+    def test_projection_skips_instructions(self):
+        response, recipe_selects = self.search({'recipe_name': 'Recipe 1234', 'chart_type': '#1'})
+        self.assertEqual(len(recipe_selects), 1)
+        self.assertNotIn('instructions', recipe_selects[0])
+
+    def test_bar_chart_built_from_same_projection(self):
+        response, recipe_selects = self.search({'recipe_name': 'Recipe 4999', 'chart_type': '#2'})
+        self.assertIsNotNone(response.context['chart'])
+        self.assertEqual(len(recipe_selects), 1)
+        self.assertEqual(self.instances, 0)
+
+    def test_pie_and_line_charts_add_one_grouped_query(self):
+        for chart_type in ['#3', '#4']:
+            response, recipe_selects = self.search({'difficulty': 'Easy', 'chart_type': chart_type})
+            self.assertEqual(len(recipe_selects), 2)
+            self.assertIn('GROUP BY', recipe_selects[1])
+            self.assertEqual(self.instances, 0)
+
+# Chart Job Tests
+@override_settings(CHART_RENDER_WORKERS=0)
+class ChartJobTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        cls.series = bar_series(['Recipe 1', 'Recipe 2'], [10, 20])
+
+    def setUp(self):
+        chart_cache.clear()
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_no_job_without_series(self):
+        self.assertIsNone(submit_chart_job('#1', None))
+
+    def test_job_rendered_in_request_without_workers(self):
+        job = submit_chart_job('#2', self.series)
+        self.assertEqual(job.status, ChartJob.DONE)
+        self.assertTrue(job.image)
+        self.assertEqual(job.pk, get_chart_key(self.series))
+
+    def test_repeat_search_reuses_chart(self):
+        first = submit_chart_job('#2', self.series)
+        with patch('recipes.jobs.render_chart') as render_chart:
+            second = submit_chart_job('#2', self.series)
+        render_chart.assert_not_called()
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(ChartJob.objects.count(), 1)
+        self.assertNotEqual(first.pk, submit_chart_job('#2', self.series, 'svg').pk)
+
+    def test_failed_chart_is_rendered_again(self):
+        series = self.series
+        ChartJob.objects.create(pk=get_chart_key(series), chart_type='#2', status=ChartJob.FAILED)
+        job = submit_chart_job('#2', series)
+        self.assertEqual(job.status, ChartJob.DONE)
+        self.assertEqual(ChartJob.objects.count(), 1)
+
+    @override_settings(CHART_RENDER_WORKERS=1)
+    def test_cached_chart_completes_job_without_pool(self):
+        chart_cache.set(get_chart_key(self.series), b'cached')
+        with patch('recipes.jobs.get_executor') as get_executor:
+            job = submit_chart_job('#2', self.series)
+        get_executor.assert_not_called()
+        self.assertEqual(job.status, ChartJob.DONE)
+        self.assertEqual(job.image, b'cached')
+
+    def test_expired_jobs_are_cleaned_up(self):
+        old_job = ChartJob.objects.create(pk='old', chart_type='#2', status=ChartJob.DONE, image=b'old')
+        ChartJob.objects.filter(pk=old_job.pk).update(created=timezone.now() - timedelta(days=1))
+        submit_chart_job('#2', self.series)
+        self.assertFalse(ChartJob.objects.filter(pk=old_job.pk).exists())
+
+    def test_stale_pending_chart_is_submitted_again(self):
+        series = self.series
+        ChartJob.objects.create(pk=get_chart_key(series), chart_type='#2')
+        ChartJob.objects.update(created=timezone.now() - timedelta(minutes=5))
+        job = submit_chart_job('#2', series)
+        self.assertEqual(job.status, ChartJob.DONE)
+        self.assertEqual(ChartJob.objects.get().status, ChartJob.DONE)
+
+    def test_chart_view_returns_finished_image(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2', status=ChartJob.DONE, image=b'png')
+        response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, b'png')
+        self.assertEqual(response['ETag'], f'"{job.pk}"')
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_chart_view_returns_304_for_matching_etag(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2', status=ChartJob.DONE, image=b'png')
+        response = self.client.get(
+            reverse('recipes:chart', kwargs={'pk': job.pk}),
+            HTTP_IF_NONE_MATCH=f'"{job.pk}"'
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_chart_view_returns_image_for_stale_etag(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2', status=ChartJob.DONE, image=b'png')
+        response = self.client.get(
+            reverse('recipes:chart', kwargs={'pk': job.pk}),
+            HTTP_IF_NONE_MATCH='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'png')
+
+    def test_chart_view_reports_failed_job(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2', status=ChartJob.FAILED)
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'status': 'failed'})
+
+    def test_search_links_to_chart_image(self):
+        Recipe.objects.create(name='Toast', ingredients='bread, butter', cooking_time=5, instructions='Toast it')
+        response = self.client.post('/search/', {'chart_type': '#2'})
+        job = response.context['chart']
+        self.assertContains(response, f'<img src="{reverse("recipes:chart", kwargs={"pk": job.pk})}"')
+        self.assertNotContains(response, 'base64')
+
+    def test_failed_save_marks_job_failed(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2')
+        future = Future()
+        future.set_result(b'png')
+        update = ChartJob.objects.filter(pk=job.pk).update
+        def locked(**fields):
+            if fields['status'] == ChartJob.DONE:
+                raise OperationalError('database table is locked')
+            return update(**fields)
+        with patch('recipes.jobs.time.sleep'), patch('django.db.models.query.QuerySet.update', side_effect=locked):
+            finish_chart_job(job.pk, threading.get_ident(), future)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ChartJob.FAILED)
+
+    def test_stale_pending_job_reported_failed(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2')
+        ChartJob.objects.filter(pk=job.pk).update(created=timezone.now() - timedelta(minutes=5))
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 500)
+
+    def test_chart_view_returns_pending_status(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2')
+        response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'status': 'pending'})
+
+    def test_chart_view_can_be_cached_for_anonymous_users(self):
+        job = ChartJob.objects.create(pk='key', chart_type='#2', status=ChartJob.DONE, image=b'png')
+        self.client.logout()
+        response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    @override_settings(CHART_RENDER_WORKERS=1)
+    def test_search_returns_pending_job_when_pool_is_busy(self):
+        Recipe.objects.create(name='Toast', ingredients='bread, butter', cooking_time=5, instructions='Toast it')
+        with patch('recipes.jobs.get_executor') as get_executor:
+            response = self.client.post('/search/', {'chart_type': '#3'})
+        get_executor.return_value.submit.assert_called_once()
+        self.assertEqual(response.context['chart'].status, ChartJob.PENDING)
+        self.assertContains(response, 'Rendering chart...')
+        self.assertContains(response, reverse('recipes:chart', kwargs={'pk': response.context['chart'].pk}))
+
+# The pool's result thread writes to the database, so this needs committed rows
+@override_settings(CHART_RENDER_WORKERS=1)
+class ChartJobPoolTest(TransactionTestCase):
+
+    def test_job_rendered_by_process_pool(self):
+        chart_cache.clear()
+        series = bar_series(['Recipe 1'], [10])
+        job = submit_chart_job('#2', series)
+        self.assertEqual(job.status, ChartJob.PENDING)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            job.refresh_from_db()
+            if job.status != ChartJob.PENDING:
+                break
+            time.sleep(0.1)
+
+        self.assertEqual(job.status, ChartJob.DONE)
+        self.assertTrue(job.image)
+        self.assertEqual(chart_cache.get(get_chart_key(series)), bytes(job.image))
+
+    def test_broken_pool_is_replaced(self):
+        chart_cache.clear()
+        executor = get_executor()
+        # A render process that dies takes the whole pool down with it
+        with self.assertRaises(BrokenProcessPool):
+            executor.submit(os._exit, 1).result(timeout=30)
+
+        job = submit_chart_job('#2', bar_series(['Recipe 2'], [20]))
+        self.assertEqual(job.status, ChartJob.DONE)
+        self.assertTrue(job.image)
+        self.assertIsNot(get_executor(), executor)
+
 # Authentication View Tests
 class LoginViewTest(TestCase):
 
@@ -697,35 +2439,303 @@ class ChartUtilsTest(TestCase):
 
     @classmethod
     def setUpTestData(cls):
-        cls.recipe_data = pd.DataFrame({
-            'name': ['Recipe 1', 'Recipe 2'],
-            'cooking_time': [10, 20],
-            'difficulty': ['Easy', 'Hard'],
-            'ingredient_count': [3, 5]
-        })
+        cls.series = [
+            bar_series(['Recipe 1', 'Recipe 2'], [10, 20]),
+            pie_series([('Easy', 1), ('Hard', 1)]),
+            line_series([(3, 10.0, 1), (5, 20.0, 1)])
+        ]
 
-    def test_get_chart_returns_none_for_type_1(self):
-        result = get_chart('#1', self.recipe_data)
-        self.assertIsNone(result)
-    
-    def test_get_chart_returns_string_for_bar_chart(self):
-        result = get_chart('#2', self.recipe_data)
-        self.assertIsNotNone(result)
-        self.assertIsInstance(result, str)
-    
-    def test_get_chart_returns_string_for_pie_chart(self):
-        result = get_chart('#3', self.recipe_data)
-        self.assertIsNotNone(result)
-        self.assertIsInstance(result, str)
-    
-    def test_get_chart_returns_string_for_line_chart(self):
-        result = get_chart('#4', self.recipe_data)
-        self.assertIsNotNone(result)
-        self.assertIsInstance(result, str)
-    
-    def test_get_chart_returns_none_for_invalid_type(self):
-        result = get_chart('#7', self.recipe_data)
-        self.assertIsNone(result)
+    def test_render_chart_returns_png_for_every_chart_type(self):
+        for series in self.series:
+            with self.subTest(chart=series['type']):
+                self.assertTrue(render_chart(series).startswith(b'\x89PNG'))
+
+    def test_render_chart_returns_svg(self):
+        self.assertTrue(render_chart(self.series[0], 'svg').startswith(b'<svg'))
+
+class ChartCacheTest(TestCase):
+
+    def setUp(self):
+        chart_cache.clear()
+        self.series = bar_series(['Recipe 1', 'Recipe 2'], [10, 20])
+
+    @override_settings(CHART_RENDER_WORKERS=0)
+    def test_repeat_chart_is_served_from_cache(self):
+        first = submit_chart_job('#2', self.series)
+        ChartJob.objects.all().delete()
+        with patch('recipes.jobs.render_chart') as render_chart:
+            second = submit_chart_job('#2', bar_series(['Recipe 1', 'Recipe 2'], [10, 20]))
+        render_chart.assert_not_called()
+        self.assertEqual(bytes(first.image), bytes(second.image))
+
+    def test_cache_key_depends_on_series_and_format(self):
+        pie = pie_series([('Easy', 1), ('Hard', 1)])
+        self.assertEqual(get_chart_key(self.series), get_chart_key(bar_series(['Recipe 1', 'Recipe 2'], [10, 20])))
+        self.assertNotEqual(get_chart_key(self.series), get_chart_key(pie))
+        self.assertNotEqual(get_chart_key(self.series), get_chart_key(self.series, 'svg'))
+
+    @override_settings(CHART_CACHE_SIZE=2)
+    def test_cache_evicts_least_recently_used(self):
+        chart_cache.set('bar', b'bar')
+        chart_cache.set('pie', b'pie')
+        chart_cache.get('bar')
+        chart_cache.set('line', b'line')
+        self.assertEqual(len(chart_cache), 2)
+        self.assertEqual(chart_cache.get('bar'), b'bar')
+        self.assertIsNone(chart_cache.get('pie'))
+
+    def test_cache_kept_when_recipes_change(self):
+        chart_cache.set('bar', b'bar')
+        recipe = Recipe.objects.create(name='New', ingredients='a', cooking_time=5, instructions='Test')
+        recipe.delete()
+        self.assertEqual(chart_cache.get('bar'), b'bar')
+
+class ChartFormatTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bar = bar_series(['Toast <b>', 'Soup'], [5, 40])
+        cls.pie = pie_series([('Easy', 1), ('Hard', 1)])
+        cls.line = line_series([(2, 5.0, 1), (6, 40.0, 1)])
+
+    def test_series_for_bar_chart(self):
+        series = self.bar
+        self.assertEqual(series['type'], 'bar')
+        self.assertEqual(series['labels'], ['Toast <b>', 'Soup'])
+        self.assertEqual(series['values'], [5, 40])
+
+    def test_series_for_pie_chart(self):
+        series = self.pie
+        self.assertEqual(series['type'], 'pie')
+        self.assertEqual(sorted(series['labels']), ['Easy', 'Hard'])
+        self.assertEqual(series['values'], [1, 1])
+
+    def test_svg_renders_every_chart_type(self):
+        for series in [self.bar, self.pie, self.line]:
+            svg = render_svg(series).decode('utf-8')
+            self.assertTrue(svg.startswith('<svg'))
+            self.assertTrue(svg.endswith('</svg>'))
+
+    def test_svg_escapes_labels(self):
+        svg = render_svg(self.bar).decode('utf-8')
+        self.assertIn('Toast &lt;b&gt;', svg)
+        self.assertNotIn('<b>', svg)
+
+    def test_svg_pie_with_single_slice(self):
+        svg = render_svg(pie_series([('Easy', 2)])).decode('utf-8')
+        self.assertIn('<circle', svg)
+
+    def test_svg_is_smaller_than_png(self):
+        self.assertLess(len(render_svg(self.bar)), len(plot_chart(self.bar)))
+
+    @override_settings(CHART_FORMAT='svg')
+    def test_form_defaults_to_chart_format_setting(self):
+        form = RecipesSearchForm()
+        self.assertEqual(form['chart_format'].value(), 'svg')
+
+@override_settings(CHART_RENDER_WORKERS=1)
+class ChartFormatViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        Recipe.objects.create(name='Toast', ingredients='bread, butter', cooking_time=5, instructions='Toast it')
+
+    def setUp(self):
+        chart_cache.clear()
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_svg_chart_rendered_without_pool(self):
+        with patch('recipes.jobs.get_executor') as get_executor:
+            response = self.client.post('/search/', {'chart_type': '#2', 'chart_format': 'svg'})
+        get_executor.assert_not_called()
+        job = response.context['chart']
+        self.assertEqual(job.status, ChartJob.DONE)
+
+        response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(response.content.startswith(b'<svg'))
+
+    @override_settings(CHART_FORMAT='svg')
+    def test_chart_format_setting_used_when_form_omits_it(self):
+        response = self.client.post('/search/', {'chart_type': '#3'})
+        self.assertEqual(response.context['chart'].content_type, 'image/svg+xml')
+
+    def test_chart_json_available_while_image_pending(self):
+        with patch('recipes.jobs.get_executor'):
+            response = self.client.post('/search/', {'chart_type': '#2', 'chart_format': 'png'})
+        job = response.context['chart']
+        self.assertEqual(job.status, ChartJob.PENDING)
+
+        response = self.client.get(reverse('recipes:chart', kwargs={'pk': job.pk}), {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['type'], 'bar')
+        self.assertEqual(response.json()['labels'], ['Toast'])
+
+        response = self.client.get(
+            reverse('recipes:chart', kwargs={'pk': job.pk}),
+            {'format': 'json'},
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+class ChartDownsamplingTest(TestCase):
+
+    def test_top_bars_keeps_small_results(self):
+        self.assertEqual(top_bars(['a', 'b'], [5, 10], 3), [('a', 5), ('b', 10)])
+
+    def test_top_bars_groups_the_rest_as_other(self):
+        bars = top_bars(['a', 'b', 'c', 'd', 'e'], [10, 50, 20, 40, 30], 3)
+        self.assertEqual(bars, [('b', 50), ('d', 40), ('Other (3 recipes)', 20)])
+
+    def test_bin_points_keeps_small_results(self):
+        self.assertEqual(bin_points([(1, 10.0, 1), (2, 20.0, 3)], 5), [(1, 10.0), (2, 20.0)])
+
+    def test_bin_points_weights_means_by_count(self):
+        points = [(1, 10.0, 1), (2, 20.0, 3), (3, 30.0, 1), (4, 40.0, 1)]
+        self.assertEqual(bin_points(points, 2), [(1.5, 17.5), (3.5, 35.0)])
+
+    @override_settings(CHART_MAX_BARS=20)
+    def test_bar_series_is_bounded(self):
+        series = bar_series([f'Recipe {i}' for i in range(10000)], range(10000))
+        self.assertEqual(len(series['labels']), 20)
+        self.assertEqual(series['labels'][0], 'Recipe 9999')
+        self.assertEqual(series['labels'][-1], 'Other (9981 recipes)')
+
+    @override_settings(CHART_MAX_POINTS=10)
+    def test_line_series_is_bounded(self):
+        series = line_series([(count, float(count), 1) for count in range(1, 101)])
+        self.assertEqual(len(series['labels']), 10)
+        self.assertEqual(series['labels'][0], 5.5)
+        self.assertEqual(series['values'][0], 5.5)
+
+    @override_settings(CHART_MAX_BARS=5, CHART_MAX_POINTS=5)
+    def test_series_follow_limit_settings(self):
+        self.assertEqual(len(bar_series([f'Recipe {i}' for i in range(100)], list(range(100)))['labels']), 5)
+        self.assertEqual(len(line_series([(count, float(count), 1) for count in range(100)])['labels']), 5)
+
+class ResultsTableTest(TestCase):
+
+    def test_rows_are_escaped(self):
+        table = render_results_table([(7, '<script>alert(1)</script> & Chips', 15, 'Easy')])
+        self.assertIn('<a href="/list/7/">&lt;script&gt;alert(1)&lt;/script&gt; &amp; Chips</a>', table)
+        self.assertNotIn('<script>', table)
+
+    def test_table_structure(self):
+        table = render_results_table([(1, 'Soup', 20, 'Easy'), (2, 'Stew', 90, 'Hard')])
+        self.assertTrue(table.startswith('<table class="results-table">'))
+        self.assertEqual(table.count('<tr>'), 3)
+        self.assertIn('<td>90 min</td><td>Hard</td>', table)
+
+    def test_streams_one_row_at_a_time(self):
+        rows = iter([(1, 'Soup', 20, 'Easy'), (2, 'Stew', 90, 'Hard')])
+        chunks = iter_results_table(rows)
+        next(chunks)
+        self.assertIn('Soup', next(chunks))
+        self.assertEqual(next(rows)[1], 'Stew')
+
+    def test_search_renders_without_pandas(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        Recipe.objects.create(name='Fish & Chips', ingredients='fish, potatoes', cooking_time=30, instructions='Fry', author=user)
+        self.client.login(username='testuser', password='testpass123')
+
+        with patch('pandas.DataFrame', side_effect=AssertionError('search built a DataFrame')):
+            response = self.client.post('/search/', {'recipe_name': 'fish', 'chart_type': '#1'})
+        self.assertContains(response, 'Fish &amp; Chips</a></td><td>30 min</td>')
+
+# Compares the streamed table with the DataFrame it replaced at 1k, 10k and 100k rows
+@tag('slow')
+class ResultsTableBenchmarkTest(TestCase):
+
+    def test_faster_and_smaller_than_pandas(self):
+        for size in (1000, 10000, 100000):
+            rows = get_benchmark_rows(size)
+            pandas_time, pandas_peak = measure(render_pandas_table, rows, repeat=1)
+            stream_time, stream_peak = measure(render_results_table, rows, repeat=1)
+            with self.subTest(rows=size):
+                self.assertLess(stream_time, pandas_time / 2)
+                self.assertLess(stream_peak, pandas_peak / 2)
+
+    def test_command_reports_each_size(self):
+        out = StringIO()
+        call_command('benchmark_results_table', sizes=[100, 200], repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['100', '200'])
+
+# Renders many charts outside the cache and checks the worker's RSS stays flat
+class ChartMemoryTest(TestCase):
+
+    @staticmethod
+    def get_rss():
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    @tag('slow')
+    def test_rendering_1000_charts_does_not_leak(self):
+        if not os.path.exists('/proc/self/statm'):
+            self.skipTest('RSS measurement requires /proc')
+
+        series = [
+            bar_series(['Recipe 1', 'Recipe 2', 'Recipe 3'], [10, 20, 30]),
+            pie_series([('Easy', 1), ('Hard', 2)]),
+            line_series([(3, 10.0, 1), (4, 30.0, 1), (5, 20.0, 1)])
+        ]
+
+        # Warm up matplotlib's font and text layout caches before taking the baseline
+        for i in range(100):
+            plot_chart(series[i % 3])
+        gc.collect()
+        baseline = self.get_rss()
+
+        for i in range(1000):
+            plot_chart(series[i % 3])
+        gc.collect()
+
+        growth = self.get_rss() - baseline
+        self.assertLess(growth, 20 * 1024 * 1024)
+
+    def test_rendering_does_not_register_pyplot_figures(self):
+        plot_chart(bar_series(['a'], [1]))
+        self.assertNotIn('matplotlib.pyplot', sys.modules)
+
+# Boots a worker in a fresh interpreter under -X importtime, so the cost of what
+# recipe_project.wsgi and the URLconf import at startup can't creep back up
+class StartupImportTest(TestCase):
+    ANALYTICS_PACKAGES = ('pandas', 'matplotlib', 'numpy')
+    IMPORT_BUDGET = 1.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import recipe_project.wsgi, recipes.urls'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='recipe_project.settings'),
+            capture_output=True,
+            text=True,
+            check=True
+        )
+
+        # Lines look like 'import time:  self [us] | cumulative | imported package'
+        cls.import_times = {}
+        for line in result.stderr.splitlines():
+            fields = line.removeprefix('import time:').split('|')
+            if line.startswith('import time:') and fields[1].strip().isdigit():
+                cls.import_times[fields[2].strip()] = int(fields[1]) / 1e6
+
+    def test_boot_does_not_import_analytics_stack(self):
+        self.assertIn('recipe_project.wsgi', self.import_times)
+        packages = {name.split('.')[0] for name in self.import_times}
+        for package in self.ANALYTICS_PACKAGES:
+            with self.subTest(package=package):
+                self.assertNotIn(package, packages)
+
+    @tag('slow')
+    def test_boot_import_time_within_budget(self):
+        self.assertLess(self.import_times['recipe_project.wsgi'] + self.import_times['recipes.urls'], self.IMPORT_BUDGET)
 
 # Integration Tests
 class UserFlowIntegrationTest(TestCase):
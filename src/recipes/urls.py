@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import home, RecipeListView, RecipeDetailView, RecipeCreateView, RecipeUpdateView, RecipeDeleteView, search, profile, toggle_favorite
+from .views import home, RecipeListView, RecipeDetailView, RecipeCreateView, RecipeUpdateView, RecipeDeleteView, search, chart, pantry, leaderboard, profile, toggle_favorite, favorite_state
 
 app_name = 'recipes'
 
@@ -10,7 +10,11 @@ urlpatterns = [
     path('list/<pk>/edit/', RecipeUpdateView.as_view(), name='edit'),
     path('list/<pk>/delete/', RecipeDeleteView.as_view(), name='delete'),
     path('list/<pk>/favorite/', toggle_favorite, name='favorite'),
+    path('favorites/state/', favorite_state, name='favorite_state'),
     path('search/', search, name='search'),
+    path('search/chart/<str:pk>/', chart, name='chart'),
+    path('pantry/', pantry, name='pantry'),
+    path('leaderboard/', leaderboard, name='leaderboard'),
     path('add/', RecipeCreateView.as_view(), name='add'),
     path('profile/', profile, name='profile')
 ]
\ No newline at end of file
@@ -1,49 +1,284 @@
 from io import BytesIO
-import base64
-import matplotlib.pyplot as plt
+from collections import OrderedDict
+import hashlib
+import heapq
+import json
+import math
+import threading
+from django.conf import settings
+from django.utils.html import escape
 
-def get_graph():
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+# Matplotlib's default colour cycle, so SVG charts match the PNG ones
+COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+WIDTH = 800
+HEIGHT = 500
+
+class ChartCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'CHART_CACHE_SIZE', 128)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+chart_cache = ChartCache()
+
+# Keeps the recipes with the longest cooking times and averages the rest into one bar
+def top_bars(names, cooking_times, limit):
+    bars = list(zip(names, cooking_times))
+    if len(bars) <= limit:
+        return bars
+
+    total = sum(time for name, time in bars)
+    top = heapq.nlargest(limit - 1, bars, key=lambda bar: bar[1])
+    rest = len(bars) - len(top)
+    other = (total - sum(time for name, time in top)) / rest
+    return top + [(f'Other ({rest} recipes)', round(other))]
+
+# Merges (x, mean, count) points into at most limit equal-width x ranges,
+# keeping each range's mean weighted by how many recipes it holds
+def bin_points(points, limit):
+    if len(points) <= limit:
+        return [(x, mean) for x, mean, count in points]
+
+    low = points[0][0]
+    width = math.ceil((points[-1][0] - low + 1) / limit)
+    bins = {}
+    for x, mean, count in points:
+        total, recipes = bins.get((x - low) // width, (0, 0))
+        bins[(x - low) // width] = (total + mean * count, recipes + count)
+
+    return [
+        (low + index * width + (width - 1) / 2, total / recipes)
+        for index, (total, recipes) in sorted(bins.items())
+    ]
+
+def bar_series(names, cooking_times):
+    bars = top_bars(names, cooking_times, getattr(settings, 'CHART_MAX_BARS', 20))
+    return {
+        'type': 'bar',
+        'title': 'Cooking Time by Recipe',
+        'xlabel': 'Recipe',
+        'ylabel': 'Cooking Time (minutes)',
+        'labels': [str(name) for name, time in bars],
+        'values': [int(time) for name, time in bars]
+    }
+
+# Takes (difficulty, count) pairs
+def pie_series(difficulty_counts):
+    difficulty_counts = list(difficulty_counts)
+    return {
+        'type': 'pie',
+        'title': 'Recipes by Difficulty',
+        'labels': [str(difficulty) for difficulty, count in difficulty_counts],
+        'values': [int(count) for difficulty, count in difficulty_counts]
+    }
+
+# Takes (ingredient count, average cooking time, number of recipes) points
+def line_series(cooking_times):
+    points = bin_points(list(cooking_times), getattr(settings, 'CHART_MAX_POINTS', 50))
+    return {
+        'type': 'line',
+        'title': 'Cooking Time vs Number of Ingredients',
+        'xlabel': 'Number of Ingredients',
+        'ylabel': 'Average Cooking Time (minutes)',
+        'labels': [int(x) if float(x).is_integer() else round(float(x), 1) for x, mean in points],
+        'values': [round(float(mean), 1) for x, mean in points]
+    }
+
+def get_chart_format(chart_format=None):
+    if chart_format in CONTENT_TYPES:
+        return chart_format
+    return getattr(settings, 'CHART_FORMAT', 'png')
+
+def get_chart_key(series, chart_format='png'):
+    digest = hashlib.sha256(chart_format.encode('utf-8'))
+    digest.update(json.dumps(series, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def get_etag(image):
+    return hashlib.sha256(image).hexdigest()[:32]
+
+def get_graph(canvas):
     buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
+    canvas.print_png(buffer)
     image_png = buffer.getvalue()
-    graph = base64.b64encode(image_png)
-    graph = graph.decode('utf-8')
     buffer.close()
 
-    return graph
-
-def get_chart(chart_type, data, **kwargs):
-    plt.switch_backend('AGG')
-    fig = plt.figure(figsize=(8,5))
-
-    if chart_type == '#1':
-        return None
-
-    if chart_type == '#2':
-        plt.bar(data['name'], data['cooking_time'])
-        plt.xlabel('Recipe')
-        plt.ylabel('Cooking Time (minutes)')
-        plt.title('Cooking Time by Recipe')
-        plt.xticks(rotation=45, ha='right')
-
-    elif chart_type == '#3':
-        difficulty_counts = data['difficulty'].value_counts()
-        plt.pie(difficulty_counts, labels=difficulty_counts.index, autopct='%1.1f%%')
-        plt.title('Recipes by Difficulty')
-    
-    elif chart_type == '#4':
-        data_sorted = data.sort_values('ingredient_count')
-        plt.plot(data_sorted['ingredient_count'], data_sorted['cooking_time'], marker='o')
-        plt.xlabel('Number of Ingredients')
-        plt.ylabel('Cooking Time (minutes)')
-        plt.title('Cooking Time vs Number of Ingredients')
+    return image_png
+
+def render_chart(series, chart_format='png'):
+    if chart_format == 'svg':
+        return render_svg(series)
+    return plot_chart(series)
+
+# Figures are built directly rather than through pyplot, so nothing is kept in
+# pyplot's global figure manager and concurrent requests can't share state.
+# Matplotlib is imported here so workers only load it once they draw a PNG
+def plot_chart(series):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(WIDTH / 100, HEIGHT / 100))
+    canvas = FigureCanvasAgg(fig)
 
+    try:
+        ax = fig.subplots()
+
+        if series['type'] == 'bar':
+            ax.bar(series['labels'], series['values'])
+            for label in ax.get_xticklabels():
+                label.set(rotation=45, horizontalalignment='right')
+
+        elif series['type'] == 'pie':
+            ax.pie(series['values'], labels=series['labels'], autopct='%1.1f%%')
+
+        elif series['type'] == 'line':
+            ax.plot(series['labels'], series['values'], marker='o')
+
+        ax.set_title(series['title'])
+        if 'xlabel' in series:
+            ax.set_xlabel(series['xlabel'])
+            ax.set_ylabel(series['ylabel'])
+
+        fig.tight_layout()
+
+        return get_graph(canvas)
+    finally:
+        fig.clear()
+
+def get_ticks(low, high, count=5):
+    if high <= low:
+        high = low + 1
+    step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(step))
+    step = next(nice * magnitude for nice in (1, 2, 2.5, 5, 10) if nice * magnitude >= step)
+    first = math.floor(low / step) * step
+    last = math.ceil(high / step) * step
+    return [first + step * i for i in range(round((last - first) / step) + 1)]
+
+# Hand-written SVG keeps vector charts to a few KB and skips matplotlib entirely
+def render_svg(series):
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {WIDTH} {HEIGHT}" '
+        f'width="{WIDTH}" height="{HEIGHT}" font-family="sans-serif" font-size="12">',
+        f'<text x="{WIDTH / 2}" y="28" text-anchor="middle" font-size="16">{escape(series["title"])}</text>'
+    ]
+
+    if series['type'] == 'pie':
+        parts.extend(svg_pie(series))
+    else:
+        parts.extend(svg_axes(series))
+
+    parts.append('</svg>')
+    return ''.join(parts).encode('utf-8')
+
+def svg_pie(series):
+    cx, cy, r = WIDTH / 2, HEIGHT / 2 + 15, 170
+    total = sum(series['values'])
+    angle = math.pi / 2
+    parts = []
+
+    for i, (label, value) in enumerate(zip(series['labels'], series['values'])):
+        color = COLORS[i % len(COLORS)]
+        sweep = 2 * math.pi * value / total
+
+        if value == total:
+            parts.append(f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{color}"/>')
+        else:
+            x1, y1 = cx + r * math.cos(angle), cy - r * math.sin(angle)
+            x2, y2 = cx + r * math.cos(angle + sweep), cy - r * math.sin(angle + sweep)
+            large = 1 if sweep > math.pi else 0
+            parts.append(
+                f'<path d="M{cx},{cy}L{x1:.1f},{y1:.1f}A{r},{r} 0 {large} 0 {x2:.1f},{y2:.1f}Z" fill="{color}"/>'
+            )
+
+        middle = angle + sweep / 2
+        lx, ly = cx + (r + 20) * math.cos(middle), cy - (r + 20) * math.sin(middle)
+        px, py = cx + r * 0.6 * math.cos(middle), cy - r * 0.6 * math.sin(middle)
+        anchor = 'start' if math.cos(middle) >= 0 else 'end'
+        parts.append(f'<text x="{lx:.1f}" y="{ly:.1f}" text-anchor="{anchor}">{escape(label)}</text>')
+        parts.append(f'<text x="{px:.1f}" y="{py:.1f}" text-anchor="middle">{100 * value / total:.1f}%</text>')
+        angle += sweep
+
+    return parts
+
+def svg_axes(series):
+    left, right, top = 70, WIDTH - 20, 50
+    bottom = HEIGHT - (110 if series['type'] == 'bar' else 60)
+    values = series['values']
+    y_ticks = get_ticks(min(0, min(values)), max(values))
+    y_low, y_high = y_ticks[0], y_ticks[-1]
+
+    def y_pos(value):
+        return bottom - (value - y_low) / (y_high - y_low) * (bottom - top)
+
+    parts = [f'<path d="M{left},{top}V{bottom}H{right}" fill="none" stroke="#000"/>']
+
+    for tick in y_ticks:
+        parts.append(f'<text x="{left - 6}" y="{y_pos(tick) + 4:.1f}" text-anchor="end">{tick:g}</text>')
+
+    if series['type'] == 'bar':
+        band = (right - left) / len(values)
+        for i, (label, value) in enumerate(zip(series['labels'], values)):
+            x = left + band * i
+            y = y_pos(value)
+            lx = x + band / 2
+            parts.append(
+                f'<rect x="{x + band * 0.1:.1f}" y="{y:.1f}" width="{band * 0.8:.1f}" '
+                f'height="{y_pos(0) - y:.1f}" fill="{COLORS[0]}"/>'
+            )
+            parts.append(
+                f'<text x="{lx:.1f}" y="{bottom + 14}" text-anchor="end" '
+                f'transform="rotate(-45 {lx:.1f} {bottom + 14})">{escape(label)}</text>'
+            )
     else:
-        print('Unknown chart type')
-        return None
-    
-    plt.tight_layout()
+        x_ticks = get_ticks(min(series['labels']), max(series['labels']))
+        x_low, x_high = x_ticks[0], x_ticks[-1]
+
+        def x_pos(value):
+            return left + (value - x_low) / (x_high - x_low) * (right - left)
+
+        for tick in x_ticks:
+            parts.append(f'<text x="{x_pos(tick):.1f}" y="{bottom + 18}" text-anchor="middle">{tick:g}</text>')
+
+        points = [(x_pos(x), y_pos(y)) for x, y in zip(series['labels'], values)]
+        path = ' '.join(f'{x:.1f},{y:.1f}' for x, y in points)
+        parts.append(f'<polyline points="{path}" fill="none" stroke="{COLORS[0]}" stroke-width="1.5"/>')
+        for x, y in points:
+            parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3" fill="{COLORS[0]}"/>')
 
-    chart = get_graph()
-    return chart
\ No newline at end of file
+    parts.append(f'<text x="{(left + right) / 2}" y="{HEIGHT - 8}" text-anchor="middle">{escape(series["xlabel"])}</text>')
+    parts.append(
+        f'<text x="16" y="{(top + bottom) / 2}" text-anchor="middle" '
+        f'transform="rotate(-90 16 {(top + bottom) / 2})">{escape(series["ylabel"])}</text>'
+    )
+    return parts
@@ -4,27 +4,173 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.urls import reverse_lazy
-from django.http import JsonResponse
-import pandas as pd
-from .models import Recipe
-from .forms import RecipesSearchForm, AddRecipeForm 
-from .utils import get_chart
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
+import json
+from .models import Recipe, ChartJob, CacheGeneration, DIFFICULTY_RANKS
+from .forms import RecipesSearchForm, AddRecipeForm, PantryForm, RecipeListForm
+from .jobs import submit_chart_job
+from .search import get_search_backend
+from .indexes import ingredient_index
+from .rankings import record_favorite_events, get_most_favorited, get_trending
+from .generations import bump_generation, get_generations
+from .pages import cache_anonymous_page
+from .pagination import MAX_INTEGER, KeysetPaginator, is_fragment_request
+from .tables import render_results_table
+from .utils import bar_series, pie_series, line_series, get_chart_format, get_etag
 
 # Create your views here.
+
+# Each ordering ends in pk so pages can be cut by keyset, and each has a matching index on Recipe
+SORT_ORDERINGS = {
+    'newest': ('-pk',),
+    'cooking_time': ('cooking_time', 'pk'),
+    'difficulty': ('difficulty_rank', 'cooking_time', 'pk'),
+    'favorites': ('-favorite_count', '-pk')
+}
+
+@cache_anonymous_page
 def home(request):
-    recipes = Recipe.objects.all()
-    return render(request, 'recipes/home.html', {'recipes': recipes})
+    page = KeysetPaginator(Recipe.objects.for_cards().with_favorite_state(request.user)).get_page(request.GET.get('cursor'))
+
+    context = {
+        'recipes': page.object_list,
+        'next_url': page.get_next_url(request),
+        'grid_id': 'recipe-grid',
+        'card_template': 'recipes/_home_card.html'
+    }
+
+    # Infinite scroll asks for just the next page of cards
+    if is_fragment_request(request):
+        return render(request, 'recipes/_recipe_page.html', context)
+
+    return render(request, 'recipes/home.html', context)
 
 class RecipeListView(LoginRequiredMixin, ListView):
     model = Recipe
     template_name = 'recipes/list.html'
     context_object_name = 'recipes'
 
+    def get_queryset(self):
+        queryset = super().get_queryset().for_cards().with_favorite_state(self.request.user)
+        self.filter_form = RecipeListForm(self.request.GET)
+        filters = self.filter_form.cleaned_data if self.filter_form.is_valid() else {}
+
+        self.ordering_fields = SORT_ORDERINGS[filters.get('sort') or 'newest']
+
+        # Filtering on the rank rather than the name lets the sort indexes lead with it,
+        # and once it is fixed it no longer needs to be part of the ordering
+        if filters.get('difficulty'):
+            queryset = queryset.filter(difficulty_rank=DIFFICULTY_RANKS[filters['difficulty']])
+            self.ordering_fields = tuple(field for field in self.ordering_fields if field != 'difficulty_rank')
+
+        # Only the orderings that include cooking time can seek on it. The others read in
+        # their own index order and check cooking time as they go, which stops once a page
+        # is full, so the + 0 keeps the database from preferring a range scan and a sort
+        max_cooking_time = filters.get('max_cooking_time')
+        if max_cooking_time and 'cooking_time' in self.ordering_fields:
+            queryset = queryset.filter(cooking_time__lte=max_cooking_time)
+        elif max_cooking_time:
+            queryset = queryset.alias(any_cooking_time=F('cooking_time') + 0).filter(any_cooking_time__lte=max_cooking_time)
+
+        return queryset
+
+    def get_paginate_by(self, queryset):
+        return settings.RECIPES_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, ordering=self.ordering_fields, page_size=page_size)
+        page = paginator.get_page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_next()
+
+    def get_template_names(self):
+        if is_fragment_request(self.request):
+            return ['recipes/_recipe_page.html']
+        return super().get_template_names()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['next_url'] = context['page_obj'].get_next_url(self.request)
+        context['grid_id'] = 'recipe-grid'
+        context['card_template'] = 'recipes/_recipe_card.html'
+        context['filter_form'] = self.filter_form
+        return context
+
 class RecipeDetailView(LoginRequiredMixin, DetailView):
     model = Recipe
     template_name = 'recipes/detail.html'
     context_object_name = 'recipe'
 
+    def get_queryset(self):
+        return super().get_queryset().with_favorite_state(self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['similar_recipes'] = self.object.get_similar_recipes()
+        return context
+
+# Runs a search from RecipesSearchForm.get_normalized_data() and returns the
+# matching ids, the rendered results table and the chart series
+def get_search_results(query):
+    recipe_name = query['recipe_name']
+    ingredient = query['ingredient']
+    keywords = query['keywords']
+    chart_type = query['chart_type']
+
+    backend = get_search_backend()
+    qs = backend.filter(Recipe.objects.all(), recipe_name, ingredient, keywords)
+
+    # AND/OR/NOT ingredient queries are answered from the in-memory bitmap index
+    if query['ingredient_query']:
+        qs = backend.filter_pks(qs, ingredient_index.search(query['ingredient_query']))
+
+    if query['difficulty']:
+        qs = qs.filter(difficulty=query['difficulty'])
+
+    if query['max_cooking_time']:
+        qs = qs.filter(cooking_time__lte=query['max_cooking_time'])
+
+    # Best matches first when searching by text
+    ranked = backend.rank(qs, recipe_name, ingredient, keywords)
+
+    # One projection of just the columns the table and bar chart need, without
+    # building Recipe instances or loading the ingredients and instructions text
+    rows = list(ranked.values_list('pk', 'name', 'cooking_time', 'difficulty'))
+    if not rows:
+        return {'pks': [], 'table': None, 'series': None}
+
+    pks, names, cooking_times = zip(*(row[:3] for row in rows))
+
+    # The pie and line charts only need totals, which the database groups for us
+    if chart_type == '#2':
+        series = bar_series(names, cooking_times)
+    elif chart_type == '#3':
+        series = pie_series(qs.difficulty_counts())
+    elif chart_type == '#4':
+        series = line_series(qs.cooking_time_by_ingredient_count())
+    else:
+        series = None
+
+    return {
+        'pks': list(pks),
+        'table': render_results_table(rows),
+        'series': series
+    }
+
+# Popular searches repeat constantly, so results are cached by the normalised query
+# and the recipes generation, which any recipe change moves on
+def get_search_key(request, query):
+    generation = get_generations(request).get(CacheGeneration.RECIPES, (0, None))[0]
+    digest = hashlib.sha256(json.dumps([generation, query], sort_keys=True).encode('utf-8'))
+    return f'search:{digest.hexdigest()}'
+
 @login_required
 def search(request):
     form = RecipesSearchForm(request.POST or None)
@@ -32,46 +178,17 @@ def search(request):
     chart = None
 
     if request.method == 'POST' and form.is_valid():
-        recipe_name = form.cleaned_data['recipe_name']
-        ingredient = form.cleaned_data['ingredient']
-        difficulty = form.cleaned_data['difficulty']
-        max_cooking_time = form.cleaned_data['max_cooking_time']
-        chart_type = form.cleaned_data['chart_type']
-
-        qs = Recipe.objects.all()
-
-        if recipe_name:
-            qs = qs.filter(name__icontains=recipe_name)
-        
-        if ingredient:
-            qs = qs.filter(ingredients__icontains=ingredient)
-
-        if difficulty:
-            qs = qs.filter(difficulty=difficulty)
-
-        if max_cooking_time:
-            qs = qs.filter(cooking_time__lte=max_cooking_time)
-
-        if qs.exists():
-            data = []
-            for recipe in qs:
-                data.append({
-                    'Name': f'<a href="{recipe.get_absolute_url()}">{recipe.name}</a>',
-                    'Cooking Time': f'{recipe.cooking_time} min',
-                    'Difficulty': recipe.difficulty
-                })
-            
-            recipes_df = pd.DataFrame(data)
-            recipes_df = recipes_df.to_html(escape=False, index=False, classes='results-table')
-
-            chart_data = pd.DataFrame({
-                'name': [recipe.name for recipe in qs],
-                'cooking_time': [recipe.cooking_time for recipe in qs],
-                'difficulty': [recipe.difficulty for recipe in qs],
-                'ingredient_count': [len(recipe.get_ingredients_list()) for recipe in qs]
-            })
-
-            chart = get_chart(chart_type, chart_data)
+        query = form.get_normalized_data()
+        chart_format = get_chart_format(form.cleaned_data['chart_format'])
+
+        key = get_search_key(request, query)
+        results = caches['search'].get(key)
+        if results is None:
+            results = get_search_results(query)
+            caches['search'].set(key, results, settings.SEARCH_CACHE_TIMEOUT)
+
+        recipes_df = results['table']
+        chart = submit_chart_job(query['chart_type'], results['series'], chart_format)
 
     context={
         'form': form,
@@ -81,6 +198,89 @@ def search(request):
 
     return render(request, 'recipes/search.html', context)
 
+# Chart URLs are keyed by the chart's content, so a chart at a given URL never changes
+# and any cache, shared or not, can keep it for a year
+CHART_MAX_AGE = 365 * 24 * 60 * 60
+
+def chart(request, pk):
+    job = get_object_or_404(ChartJob.objects.defer('image'), pk=pk)
+
+    # The plotted values are available straight away for clients that draw their own charts
+    if request.GET.get('format') == 'json':
+        response = JsonResponse(job.series, json_dumps_params={'separators': (',', ':')})
+        etag = f'"{get_etag(response.content)}"'
+        response = get_conditional_response(request, etag=etag, response=response)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=CHART_MAX_AGE, immutable=True)
+        return response
+
+    # A job whose render never reported back has failed, so the page stops polling
+    if job.status == ChartJob.PENDING and job.created < timezone.now() - timedelta(seconds=settings.CHART_RENDER_TIMEOUT):
+        job.status = ChartJob.FAILED
+
+    if job.status == ChartJob.PENDING:
+        return JsonResponse({'status': job.status}, status=202)
+
+    if job.status == ChartJob.FAILED:
+        return JsonResponse({'status': job.status}, status=500)
+
+    etag = f'"{job.pk}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(job.image, content_type=job.content_type)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=CHART_MAX_AGE, immutable=True)
+
+    return response
+
+# Recipes ranked by how much of them the user's pantry covers, from the in-memory ingredient index
+@login_required
+def pantry(request):
+    form = PantryForm(request.GET or None)
+    results = None
+
+    if form.is_valid():
+        matches = ingredient_index.cover(Recipe.split_ingredients(form.cleaned_data['ingredients']))
+        recipes = Recipe.objects.only('name', 'cooking_time', 'difficulty').in_bulk([pk for pk, coverage, missing in matches])
+        results = [
+            {'recipe': recipes[pk], 'coverage': round(coverage * 100), 'missing': missing}
+            for pk, coverage, missing in matches
+            if pk in recipes
+        ]
+
+    context = {
+        'form': form,
+        'results': results
+    }
+
+    return render(request, 'recipes/pantry.html', context)
+
+# Both boards read the materialised counts kept by the favorite toggle, never a
+# Count over every favorite
+def leaderboard(request):
+    most_favorited = get_most_favorited()
+    trending = get_trending()
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'most_favorited': [
+                {'id': recipe.pk, 'name': recipe.name, 'favorite_count': recipe.favorite_count}
+                for recipe in most_favorited
+            ],
+            'trending': [
+                {'id': recipe.pk, 'name': recipe.name, 'recent_favorites': recipe.recent_favorites}
+                for recipe in trending
+            ]
+        })
+
+    context = {
+        'most_favorited': most_favorited,
+        'trending': trending,
+        'trending_days': settings.TRENDING_DAYS
+    }
+
+    return render(request, 'recipes/leaderboard.html', context)
+
 class RecipeCreateView(LoginRequiredMixin, CreateView):
     model = Recipe
     form_class = AddRecipeForm
@@ -93,13 +293,30 @@ class RecipeCreateView(LoginRequiredMixin, CreateView):
 @login_required
 def profile(request):
     user = request.user
-    authored_recipes = user.recipes.all()
-    favorite_recipes = user.favorite_recipes.all()
+    # Filtered from Recipe rather than user.recipes, whose rows would each load the deferred author_id
+    authored_page = KeysetPaginator(Recipe.objects.for_cards().filter(author=user).with_favorite_state(user)).get_page(request.GET.get('authored'))
+    favorites_page = KeysetPaginator(user.favorite_recipes.for_cards().with_favorite_state(user)).get_page(request.GET.get('favorites'))
+
+    # Each list scrolls on its own, with its own cursor parameter
+    if is_fragment_request(request):
+        if 'favorites' in request.GET:
+            page, param, grid_id = favorites_page, 'favorites', 'favorite-grid'
+        else:
+            page, param, grid_id = authored_page, 'authored', 'authored-grid'
+
+        return render(request, 'recipes/_recipe_page.html', {
+            'recipes': page.object_list,
+            'next_url': page.get_next_url(request, param),
+            'grid_id': grid_id,
+            'card_template': 'recipes/_recipe_card.html'
+        })
 
     context = {
         'user': user,
-        'authored_recipes': authored_recipes,
-        'favorite_recipes': favorite_recipes
+        'authored_recipes': authored_page.object_list,
+        'authored_next_url': authored_page.get_next_url(request, 'authored'),
+        'favorite_recipes': favorites_page.object_list,
+        'favorites_next_url': favorites_page.get_next_url(request, 'favorites')
     }
 
     return render(request, 'recipes/profile.html', context)
@@ -122,16 +339,62 @@ class RecipeDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         recipe = self.get_object()
         return self.request.user == recipe.author
 
+# Favorite state for up to FAVORITE_STATE_LIMIT recipes at once, for pages that
+# refresh their hearts without reloading, e.g. ?ids=1,2,3
+FAVORITE_STATE_LIMIT = 100
+
+@login_required
+def favorite_state(request):
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()]
+        if any(pk < 1 or pk > MAX_INTEGER for pk in ids):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma separated list of recipe ids'}, status=400)
+
+    if len(ids) > FAVORITE_STATE_LIMIT:
+        return JsonResponse({'error': f'At most {FAVORITE_STATE_LIMIT} ids can be requested at once'}, status=400)
+
+    recipes = (
+        Recipe.objects.filter(pk__in=ids)
+        .with_favorite_state(request.user)
+        .values_list('pk', 'is_favorited', 'favorite_count')
+    )
+
+    return JsonResponse({
+        'favorites': {
+            str(pk): {'is_favorited': is_favorited, 'favorite_count': favorite_count}
+            for pk, is_favorited, favorite_count in recipes
+        }
+    })
+
+# Deleting first makes the membership check and the change one statement, and the
+# through table's unique constraint stops a concurrent click adding a second row
 @login_required
 def toggle_favorite(request, pk):
-    recipe = get_object_or_404(Recipe, pk=pk)
+    recipe = get_object_or_404(Recipe.objects.only('pk'), pk=pk)
+    Favorite = Recipe.favorited_by.through
 
-    if request.user in recipe.favorited_by.all():
-        recipe.favorited_by.remove(request.user)
-        is_favorited = False
-    else:
-        recipe.favorited_by.add(request.user)
-        is_favorited = True
+    with transaction.atomic():
+        deleted, _ = Favorite.objects.filter(recipe_id=recipe.pk, user_id=request.user.pk).delete()
+
+        if deleted:
+            Recipe.objects.filter(pk=recipe.pk).update(favorite_count=F('favorite_count') - 1)
+            record_favorite_events([(recipe.pk, request.user.pk)], -1)
+            bump_generation(CacheGeneration.FAVORITES)
+        else:
+            try:
+                with transaction.atomic():
+                    Favorite.objects.create(recipe_id=recipe.pk, user_id=request.user.pk)
+            except IntegrityError:
+                # Another request favorited it first and already counted it
+                pass
+            else:
+                Recipe.objects.filter(pk=recipe.pk).update(favorite_count=F('favorite_count') + 1)
+                record_favorite_events([(recipe.pk, request.user.pk)], 1)
+                bump_generation(CacheGeneration.FAVORITES)
+
+    is_favorited = not deleted
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'is_favorited': is_favorited})